@@ -0,0 +1,72 @@
+"""Compare steps per second of per step loop and segmented `sim.run_steps` used by nengo_3d server.
+
+Targets nengo 2.x like nengo_3d (SPA model uses `nengo.spa`, which was removed in nengo 3.0):
+
+    pip install "nengo>=2.8,<3"
+    python benchmark_run_steps.py --steps 2000
+"""
+import argparse
+import os
+import sys
+import time
+
+import nengo
+
+if nengo.version.version_info >= (3, 0):
+    sys.exit(f'benchmark_run_steps.py targets nengo 2.x, found nengo {nengo.__version__}')
+
+import nengo.spa as spa
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+
+from nengo_3d.gui import run_segments
+
+
+def large_spa_model(dimensions: int = 64) -> nengo.Network:
+    model = spa.SPA(seed=1)
+    with model:
+        model.a = spa.Buffer(dimensions=dimensions)
+        model.b = spa.Buffer(dimensions=dimensions)
+        model.c = spa.Buffer(dimensions=dimensions)
+        model.d = spa.Memory(dimensions=dimensions)
+        model.cortical = spa.Cortical(spa.Actions('c = a*b', 'd = c'))
+        model.input = spa.Input(a='A', b=lambda t: 'B' if t % 0.1 < 0.05 else 'C')
+    return model
+
+
+def per_step(sim: nengo.Simulator, steps: int, scheduled_plots: dict) -> None:
+    for s in range(sim.n_steps, sim.n_steps + steps):
+        scheduled_plots.get(s)
+        sim.step()
+
+
+def segmented(sim: nengo.Simulator, steps: int, scheduled_plots: dict, segment_steps: int = 50) -> None:
+    for segment_start, segment_end in run_segments(sim.n_steps, sim.n_steps + steps, scheduled_plots, segment_steps):
+        scheduled_plots.get(segment_start)
+        sim.run_steps(segment_end - segment_start, progress_bar=False)
+
+
+def benchmark(name: str, model: nengo.Network, steps: int) -> None:
+    with model:
+        for ens in model.all_ensembles:
+            nengo.Probe(ens, sample_every=0.001, synapse=0.01)
+    scheduled_plots = {steps // 2: []}
+    for run in [per_step, segmented]:
+        with nengo.Simulator(model, progress_bar=False) as sim:
+            start = time.perf_counter()
+            run(sim, steps, scheduled_plots)
+            elapsed = time.perf_counter() - start
+        print(f'{name:>10} {run.__name__:>10}: {steps / elapsed:10.1f} steps/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--steps', type=int, default=2000)
+    parser.add_argument('--dimensions', type=int, default=64, help='Dimensions of SPA model')
+    args = parser.parse_args()
+
+    from net import model as net_model
+
+    benchmark('net.py', net_model, args.steps)
+    benchmark('spa', large_spa_model(args.dimensions), args.steps)
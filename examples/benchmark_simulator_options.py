@@ -0,0 +1,48 @@
+"""Compare build time and steps per second of simulator options accepted by `GUI(simulator_options=...)`.
+
+    python benchmark_simulator_options.py --steps 2000
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+
+import nengo
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+
+from nengo_3d.builder import SimulatorOptions, signal_precision
+from benchmark_run_steps import large_spa_model
+
+
+def benchmark(name: str, model: nengo.Network, steps: int) -> None:
+    with model:
+        for ens in model.all_ensembles:
+            nengo.Probe(ens, sample_every=0.001, synapse=0.01)
+    for dtype, optimize, progress_bar in itertools.product(['float64', 'float32'], [True, False], [True, False]):
+        options = SimulatorOptions(dtype=dtype, optimize=optimize, progress_bar=progress_bar, seed=0)
+        model.seed = options.seed  # the same network for every option
+        start = time.perf_counter()
+        with signal_precision(options.dtype):
+            sim = nengo.Simulator(model, progress_bar=options.progress_bar, optimize=options.optimize)
+        build_time = time.perf_counter() - start
+        with sim:
+            start = time.perf_counter()
+            sim.run_steps(steps, progress_bar=False)
+            elapsed = time.perf_counter() - start
+        print(f'{name:>10} {dtype:>8} optimize={optimize!s:>5} progress_bar={progress_bar!s:>5}: '
+              f'build {build_time:6.2f}s, {steps / elapsed:10.1f} steps/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--steps', type=int, default=2000)
+    parser.add_argument('--dimensions', type=int, default=64, help='Dimensions of SPA model')
+    args = parser.parse_args()
+
+    from net import model as net_model
+
+    benchmark('net.py', net_model, args.steps)
+    benchmark('spa', large_spa_model(args.dimensions), args.steps)
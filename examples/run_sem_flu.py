@@ -36,17 +36,21 @@ seeds = np.arange(seed_start, nr_seeds)
 base_dir = os.path.dirname(__file__)
 results_dir = os.path.join(base_dir, 'data', fname)
 
-# for seed in seeds:
+
+
+def make_model(seed: int) -> nengo.spa.SPA:
+    """Model factory of sweep, runs in worker processes"""
+    return SemFlu().make_model(d=d,
+                               seed=seed,
+                               sim_len=sim_len,
+                               wta_th=wta_th,
+                               amat=amat,
+                               data_dir=results_dir,
+                               backend='nengo')
+
+
 seed = 0
-sem_flu = SemFlu()
-sem_flu.model  # actual model source
-model: nengo.spa.SPA = sem_flu.make_model(d=d,
-                                          seed=seed,
-                                          sim_len=sim_len,
-                                          wta_th=wta_th,
-                                          amat=amat,
-                                          data_dir=results_dir,
-                                          backend='nengo')
+model: nengo.spa.SPA = make_model(seed)
 
 if __name__ == "__main__":
     import nengo_3d
@@ -54,6 +58,8 @@ if __name__ == "__main__":
     # nengo.spa.enable_spa_params(model)
     nengo_3d.GUI(
         filename=__file__, model=model, local_vars=locals(),
+        # every seed is simulated in worker process on request (Sweep panel)
+        model_factory=make_model, sweep=seeds,
         # tag='goals',
         tag='wta',
         # tag='general',
@@ -0,0 +1,116 @@
+"""One simulation shown by many clients.
+
+The first client controls simulation, other clients subscribe to its output. Output frames (simulation steps, plots)
+are encoded once and put on send queue of every subscriber, so slow subscriber does not slow down simulation.
+Frames since last reset are kept in history, so client connected later catches up.
+"""
+import logging
+import queue
+import threading
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SendQueue(threading.Thread):
+    """Sends broadcast frames to one subscriber. When subscriber falls behind by `max_frames`, frames are dropped"""
+
+    def __init__(self, connection: 'nengo_3d.gui.GuiConnection', max_frames: int = 256):
+        super().__init__(name=f'nengo_3d broadcast {connection.addr}', daemon=True)
+        self.connection = connection
+        self.queue: queue.Queue[bytes] = queue.Queue(maxsize=max_frames)
+        self.dropped = 0
+        self._stop_event = threading.Event()
+
+    def put(self, frame: bytes) -> None:
+        try:
+            self.queue.put_nowait(frame)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 100 == 0:
+                logger.warning(f'{self.connection.addr} is too slow, dropped {self.dropped} frames')
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                frame = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                self.connection.sendall(frame)
+            except OSError as e:
+                logger.warning(f'{self.connection.addr} broadcast failed: {e}')
+                break
+
+
+class Broadcast:
+    """Fan out of frames produced by controlling connection to subscribed connections"""
+
+    def __init__(self, history_bytes: int = 256 * 1024 * 1024, max_frames: int = 256):
+        self.history_bytes = history_bytes
+        """Memory budget of frames kept for late subscribers, the oldest frames are dropped first"""
+        self.max_frames = max_frames
+        self.controller: Optional['nengo_3d.gui.GuiConnection'] = None
+        self.subscribers: dict['nengo_3d.gui.GuiConnection', SendQueue] = {}
+        self.history: deque[bytes] = deque()
+        self._history_size = 0
+        self._lock = threading.Lock()
+
+    def join(self, connection: 'nengo_3d.gui.GuiConnection') -> bool:
+        """Returns True if connection controls simulation"""
+        with self._lock:
+            if self.controller is None:
+                self.controller = connection
+                return True
+            return False
+
+    def is_subscriber(self, connection: 'nengo_3d.gui.GuiConnection') -> bool:
+        return self.controller is not None and self.controller is not connection
+
+    def subscribe(self, connection: 'nengo_3d.gui.GuiConnection') -> None:
+        """Start sending broadcast to connection, beginning with history"""
+        with self._lock:
+            if connection in self.subscribers:
+                return
+            send_queue = SendQueue(connection, max_frames=max(self.max_frames, len(self.history) + self.max_frames))
+            for frame in self.history:
+                send_queue.put(frame)
+            self.subscribers[connection] = send_queue
+            send_queue.start()
+        logger.info(f'{connection.addr} subscribed, {len(self.history)} frames of history '
+                    f'({self._history_size / 1024 / 1024:.1f}Mb)')
+
+    def leave(self, connection: 'nengo_3d.gui.GuiConnection') -> Optional['nengo_3d.gui.GuiConnection']:
+        """Returns new controller if controller left. The oldest subscriber takes over"""
+        with self._lock:
+            send_queue = self.subscribers.pop(connection, None)
+            if send_queue:
+                send_queue.stop()
+            if connection is not self.controller:
+                return None
+            self.controller = next(iter(self.subscribers), None)
+            if self.controller:
+                self.subscribers.pop(self.controller).stop()
+            self.history.clear()
+            self._history_size = 0
+            return self.controller
+
+    def publish(self, frame: bytes, history: bool = True) -> None:
+        with self._lock:
+            if history:
+                self.history.append(frame)
+                self._history_size += len(frame)
+                while self.history and self._history_size > self.history_bytes:
+                    self._history_size -= len(self.history.popleft())
+            for send_queue in self.subscribers.values():
+                send_queue.put(frame)
+
+    def reset(self) -> None:
+        """Simulation was reset, history is no longer valid"""
+        with self._lock:
+            self.history.clear()
+            self._history_size = 0
@@ -0,0 +1,129 @@
+"""Building of simulator with persistent decoder cache and measured build time of every ensemble and connection.
+
+Decoder cache is used by nengo only for objects with seed set manually (e.g. `nengo.Network(seed=0)`), unseeded
+models solve decoders on every build.
+"""
+import contextlib
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterator, NamedTuple, Optional
+
+import nengo
+import nengo.builder
+import nengo.cache
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SimulatorOptions(NamedTuple):
+    """Arguments of `nengo.Simulator`, set by `GUI(simulator_options=...)` and by client on reset"""
+    dtype: str = 'float64'
+    """Precision of signals, 'float32' halves memory and bandwidth of large models"""
+    optimize: bool = True
+    """Merge operators after build: slower build, faster steps"""
+    progress_bar: bool = True
+    seed: Optional[int] = None
+    """Seed of network build (encoders, gains, biases, decoders), stochastic processes get seed + 1 as in nengo.
+    None keeps `network.seed`, or seed of the connection for unseeded model. Other seed is other network, simulator can
+    not resume from checkpoints of previous build"""
+
+
+_build_lock = threading.RLock()
+"""`nengo.rc` and the model are shared by all threads, connections must not build with precision or seed of each
+other"""
+
+
+@contextlib.contextmanager
+def signal_precision(dtype: str) -> Iterator[None]:
+    """Nengo >= 3.0 reads precision of signals from `nengo.rc` when simulator is built or reset, nengo 2 always uses
+    float64. Builds and resets inside the context are serialized with other threads"""
+    with _build_lock:
+        if np.dtype(dtype) == np.float64:
+            yield  # default precision, nengo.rc is not touched
+            return
+        if not nengo.rc.has_section('precision'):
+            raise ValueError(f'Signal precision {dtype} requires nengo>=3.0, nengo {nengo.__version__} supports only '
+                             f'float64')
+        previous = nengo.rc.get('precision', 'bits')
+        nengo.rc.set('precision', 'bits', str(np.dtype(dtype).itemsize * 8))
+        try:
+            yield
+        finally:
+            nengo.rc.set('precision', 'bits', previous)
+
+
+@contextlib.contextmanager
+def network_seed(network: nengo.Network, seed: Optional[int], default: int) -> Iterator[int]:
+    """Build network with seed, with its own seed if seed is None, or with default if network is unseeded. Yields
+    the used seed.
+
+    nengo takes seeds of all objects (encoders, gains, biases, decoders) from `network.seed` of top level network,
+    unseeded network is other network on every build. Builds inside the context are serialized with other threads,
+    the seed of network is restored after build.
+    """
+    with _build_lock:
+        previous = network.seed
+        network.seed = next(s for s in (seed, previous, default) if s is not None)
+        try:
+            yield network.seed
+        finally:
+            network.seed = previous
+
+
+class ReportingDecoderCache(nengo.cache.DecoderCache):
+    """Decoder cache that remembers connections whose decoders were solved (not loaded from cache)"""
+
+    def __init__(self, readonly: bool = False, cache_dir: Optional[str] = None):
+        super().__init__(readonly=readonly, cache_dir=cache_dir)
+        self.solved: set[nengo.Connection] = set()
+
+    def wrap_solver(self, solver_fn: Callable) -> Callable:
+        def solve(conn, *args, **kwargs):
+            self.solved.add(conn)
+            return solver_fn(conn, *args, **kwargs)
+
+        return super().wrap_solver(solve)
+
+
+class TimedModel(nengo.builder.Model):
+    """Measures build time of every ensemble and connection. Time of connection includes solving decoders"""
+
+    def __init__(self, dt: float = 0.001, label: Optional[str] = None,
+                 decoder_cache: Optional[nengo.cache.DecoderCache] = None):
+        super().__init__(dt=dt, label=label, decoder_cache=decoder_cache)
+        self.build_times: dict[nengo.base.NengoObject, float] = {}
+
+    def build(self, obj, *args, **kwargs):
+        if not isinstance(obj, (nengo.Ensemble, nengo.Connection)):
+            return super().build(obj, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return super().build(obj, *args, **kwargs)
+        finally:
+            self.build_times[obj] = time.perf_counter() - start
+
+
+def default_decoder_cache_dir(filename: str) -> str:
+    """Cache of model is stored next to its file: model.py -> model_decoder_cache/"""
+    return os.path.splitext(filename)[0] + '_decoder_cache'
+
+
+def build_report(model: TimedModel, name: Callable[[nengo.base.NengoObject], str], total_time: float) -> dict:
+    """Data for `BuildReport` schema, objects are sorted from the slowest"""
+    cache = model.decoder_cache
+    objects = []
+    for obj, build_time in sorted(model.build_times.items(), key=lambda item: item[1], reverse=True):
+        cached = None
+        if isinstance(obj, nengo.Connection) and isinstance(obj.pre_obj, nengo.Ensemble) and \
+                isinstance(cache, ReportingDecoderCache):
+            cached = obj not in cache.solved
+        objects.append({'name': name(obj), 'type': type(obj).__name__, 'time': build_time, 'cached': cached})
+    return {
+        'time': total_time,
+        'decoder_cache_dir': getattr(cache, 'cache_dir', None),
+        'decoder_cache_size': cache.get_size_in_bytes() if isinstance(cache, nengo.cache.DecoderCache) else 0,
+        'objects': objects,
+    }
@@ -0,0 +1,173 @@
+"""Snapshots of simulator state.
+
+Restoring a checkpoint allows to go back in time, or to continue in rebuilt simulator (e.g. with new probes), without
+simulating everything from step 0.
+"""
+import logging
+from typing import Any, NamedTuple, Optional
+
+import nengo
+import numpy as np
+from nengo.builder.processes import SimProcess
+from nengo.builder.signal import Signal, SignalDict
+
+from nengo_3d.history import ProbeHistory
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint(NamedTuple):
+    step: int
+    signals: SignalDict
+    """Copies of mutable base signals. Views (e.g. from `sim.model.sig`) can be read from it too"""
+    probe_lengths: dict[nengo.Probe, int]
+    nbytes: int
+
+
+class BuildCheckpoint(NamedTuple):
+    step: int
+    values: dict[tuple, np.ndarray]
+    """Copies of signals by key that is the same in every build of the model (see `_signal_key`)"""
+    nbytes: int
+
+
+def _signal_key(obj: Any, name: str) -> tuple:
+    """Key of signal in `model.sig` that is the same in every build of the model"""
+    if isinstance(obj, nengo.Connection) and isinstance(obj.post_obj, nengo.Probe):
+        return obj.post_obj, 'connection', name  # connection of probe with synapse is created by every build
+    return obj, name
+
+
+class CheckpointStore:
+    """Checkpoints of one simulator, taken every `every` steps and kept within `memory_budget` bytes.
+
+    When the budget is exceeded, checkpoint closest to its neighbours is dropped, so remaining checkpoints stay
+    evenly spread over whole history.
+    """
+
+    def __init__(self, sim: nengo.Simulator, every: int = 500, memory_budget: int = 256 * 1024 * 1024,
+                 history: Optional[ProbeHistory] = None):
+        self.sim = sim
+        self.history = history or ProbeHistory(sim, keep=None)
+        """Probe data of sim, rows are counted including rows dropped after they were sent"""
+        self.every = every
+        self.memory_budget = memory_budget
+        self.checkpoints: list[Checkpoint] = []
+        """Sorted by step"""
+        self._mutable = [sig for sig in sim.signals if not sig.readonly and not sig.is_view]
+        self._model_signals: dict[tuple, Signal] = {
+            ('model', 'step'): sim.model.step,
+            ('model', 'time'): sim.model.time,
+        }
+        """Signals that can be found in other build of the same model"""
+        for obj, signals in sim.model.sig.items():
+            for name, sig in signals.items():
+                # state of process is stored under the process, one synapse instance can filter many connections
+                if isinstance(sig, Signal) and not sig.readonly and not str(name).startswith('_state_'):
+                    self._model_signals[_signal_key(obj, name)] = sig
+        keys = {sig: key for key, sig in self._model_signals.items()}
+        for op in sim.model.operators:
+            # nengo 2 keeps state of processes inside of their step functions, it is not restored
+            if isinstance(op, SimProcess) and op.output in keys:
+                for name, sig in getattr(op, 'state', {}).items():  # e.g. synapse filter, identified by its output
+                    self._model_signals[keys[op.output], 'state', name] = sig
+
+    @property
+    def nbytes(self) -> int:
+        return sum(checkpoint.nbytes for checkpoint in self.checkpoints)
+
+    def due(self) -> bool:
+        step = self.sim.n_steps
+        return step % self.every == 0 and all(checkpoint.step != step for checkpoint in self.checkpoints)
+
+    def save(self) -> Checkpoint:
+        signals = SignalDict()
+        for sig in self._mutable:
+            dict.__setitem__(signals, sig, np.array(self.sim.signals[sig]))
+        checkpoint = Checkpoint(step=self.sim.n_steps, signals=signals,
+                                probe_lengths={probe: self.history.length(probe) for probe in self.sim.model.probes},
+                                nbytes=sum(value.nbytes for value in signals.values()))
+        self.checkpoints = [c for c in self.checkpoints if c.step != checkpoint.step] + [checkpoint]
+        self.checkpoints.sort(key=lambda c: c.step)
+        self._evict()
+        return checkpoint
+
+    def _evict(self) -> None:
+        while len(self.checkpoints) > 1 and self.nbytes > self.memory_budget:
+            steps = [c.step for c in self.checkpoints] + [self.sim.n_steps]
+            # never drop the first checkpoint, there would be no way to go back to the beginning
+            i = min(range(1, len(self.checkpoints)), key=lambda i: steps[i + 1] - steps[i - 1])
+            logger.debug(f'Dropped checkpoint at step {self.checkpoints[i].step}, budget: {self.memory_budget}')
+            del self.checkpoints[i]
+
+    def nearest(self, step: int, multiple_of: int = 1) -> Optional[Checkpoint]:
+        """Latest checkpoint at or before step. Step of checkpoint must be multiple of `multiple_of` (sample_every)"""
+        return _nearest(self.checkpoints, step, multiple_of)
+
+    def restore(self, checkpoint: Checkpoint) -> None:
+        """Restore simulator that made the checkpoint, exact in nengo >= 3.0 (nengo 2 keeps state of synapses in their
+        step functions, it settles after a few time constants). Probe data recorded after the checkpoint is dropped"""
+        for sig in self._mutable:
+            self.sim.signals[sig][...] = checkpoint.signals[sig]
+        for probe, length in checkpoint.probe_lengths.items():
+            self.history.truncate(probe, length)
+        self.sim.data.reset()
+        self.sim._probe_step_time()
+
+    def detach(self) -> 'BuildCheckpoints':
+        """Checkpoints without reference to simulator, other build of the model can resume from them"""
+        checkpoints = []
+        for checkpoint in self.checkpoints:
+            values = {}
+            for key, sig in self._model_signals.items():
+                try:
+                    values[key] = np.array(checkpoint.signals[sig])
+                except KeyError:  # view on read only signal
+                    continue
+            checkpoints.append(BuildCheckpoint(step=checkpoint.step, values=values,
+                                               nbytes=sum(value.nbytes for value in values.values())))
+        return BuildCheckpoints(checkpoints, dt=self.sim.dt, seed=self.sim.model.seeds.get(self.sim.model.toplevel),
+                                every=self.every)
+
+
+class BuildCheckpoints:
+    """Checkpoints of discarded simulator (see `CheckpointStore.detach`). The simulator is released, only copies of
+    signals are kept"""
+
+    def __init__(self, checkpoints: list[BuildCheckpoint], dt: float, seed: Optional[int], every: int):
+        self.checkpoints = checkpoints
+        self.dt = dt
+        self.seed = seed
+        """Network seed of the build (`model.seeds` of top level network)"""
+        self.every = every
+
+    @property
+    def nbytes(self) -> int:
+        return sum(checkpoint.nbytes for checkpoint in self.checkpoints)
+
+    def nearest(self, step: int, multiple_of: int = 1) -> Optional[BuildCheckpoint]:
+        return _nearest(self.checkpoints, step, multiple_of)
+
+    def restore_into(self, sim: nengo.Simulator, checkpoint: BuildCheckpoint) -> None:
+        """Restore into other build of the same model (e.g. with different probes). It must be built with the same
+        network seed, otherwise ensembles have other encoders, gains and biases.
+
+        Signals known to the model builder (`sim.model.sig`) and states of processes writing to them (e.g. synapse
+        filters, nengo >= 3.0) are restored. State of processes of new objects (e.g. synapse of new probe) starts from
+        zero and settles after a few time constants. Probes of `sim` record from the checkpoint step.
+        """
+        other = CheckpointStore(sim, every=self.every, memory_budget=0)
+        restored = 0
+        for key, sig in other._model_signals.items():
+            value = checkpoint.values.get(key)
+            if value is None or value.shape != sig.shape:
+                continue
+            sim.signals[sig][...] = value
+            restored += 1
+        sim._probe_step_time()
+        logger.info(f'Restored {restored}/{len(other._model_signals)} signals at step {checkpoint.step}')
+
+
+def _nearest(checkpoints: list, step: int, multiple_of: int) -> Optional[Any]:
+    earlier = [c for c in checkpoints if c.step <= step and c.step % multiple_of == 0]
+    return earlier[-1] if earlier else None
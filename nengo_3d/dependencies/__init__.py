@@ -40,13 +40,13 @@ def install(blender_exe: str = 'blender.exe'):
         logging.debug(f'Running pip check: {" ".join(command)}')
         subprocess.check_call(command)
 
-    NENGO_3D_SCHEMAS = os.path.join(BLENDER_PIP_MODULES_PATH, 'nengo_3d_schemas.py')
-    NENGO_3D_SCHEMAS_DST = os.path.join(current_dir, '..', 'nengo_3d_schemas.py')
-
     # check internal shared communication protocols
     # windows does not support (well) file symlinks
-    if not os.path.exists(NENGO_3D_SCHEMAS):
-        shutil.copy(NENGO_3D_SCHEMAS_DST, NENGO_3D_SCHEMAS)
-    elif not filecmp.cmp(NENGO_3D_SCHEMAS, NENGO_3D_SCHEMAS_DST, shallow=True):
-        os.remove(NENGO_3D_SCHEMAS)
-        shutil.copy(NENGO_3D_SCHEMAS_DST, NENGO_3D_SCHEMAS)
+    for shared_module in ('nengo_3d_schemas.py', 'nengo_3d_frames.py', 'nengo_3d_shm.py'):
+        installed = os.path.join(BLENDER_PIP_MODULES_PATH, shared_module)
+        source = os.path.join(current_dir, '..', shared_module)
+        if not os.path.exists(installed):
+            shutil.copy(source, installed)
+        elif not filecmp.cmp(installed, source, shallow=True):
+            os.remove(installed)
+            shutil.copy(source, installed)
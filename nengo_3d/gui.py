@@ -1,9 +1,10 @@
 import itertools
+import asyncio
 import json
 import logging
-import socket
-import struct
-from collections import defaultdict
+import threading
+import time
+from collections import defaultdict, deque
 import subprocess
 import os
 from typing import *
@@ -16,9 +17,17 @@ import nengo.utils
 
 import nengo_3d.utils
 import numpy as np
+from nengo_3d import nengo_3d_frames, nengo_3d_shm
 from nengo_3d import dependencies
+from nengo_3d.builder import ReportingDecoderCache, SimulatorOptions, TimedModel, build_report, \
+    default_decoder_cache_dir, network_seed, signal_precision
+from nengo_3d.broadcast import Broadcast
+from nengo_3d.checkpoints import BuildCheckpoints, CheckpointStore
 from nengo_3d.gui_backend import Nengo3dServer, Connection
+from nengo_3d.history import ProbeHistory, clear_probes
 from nengo_3d.name_finder import NameFinder
+from nengo_3d.pacing import Pacer
+from nengo_3d.sweep import SweepProbe, SweepRunner
 import nengo_3d.schemas as schemas
 
 script_path = os.path.dirname(os.path.realpath(__file__))
@@ -41,14 +50,101 @@ class RequestedProbes(NamedTuple):
     access_path: str
     to_probe: Any
     attribute: str
+    precision: str = 'float64'
+    """see nengo_3d_frames.quantize"""
+    top_k: int = 0
+    """see schemas.Observe.top_k"""
     # vocabulary: Optional[nengo.spa.Vocabulary]
 
 
+class RunAheadFrame(NamedTuple):
+    """Steps simulated before client requested them, encoded and waiting to be sent"""
+    start: int
+    end: int
+    sample_every: int
+    blocks: list[tuple[dict, np.ndarray]]
+    nbytes: int
+
+
+def model_fingerprint(model: nengo.Network) -> tuple:
+    """Cheap identity of model structure, changes when objects are added to the model"""
+    return id(model), len(model.all_ensembles), len(model.all_nodes), len(model.all_connections), \
+           len(model.all_networks)
+
+
+def run_segments(start: int, end: int, stops: Iterable[int], max_steps: int) -> Iterator[tuple[int, int]]:
+    """Split steps [start, end) into (segment_start, segment_end) that can be computed with one `sim.run_steps` call.
+
+    Segment ends before every step in `stops` (e.g. scheduled plots) and at multiples of `max_steps`.
+    """
+    stops = sorted(s for s in stops if start < s < end)
+    step = start
+    while step < end:
+        segment_end = min(end, (step // max_steps + 1) * max_steps)
+        while stops and stops[0] <= step:
+            stops.pop(0)
+        if stops:
+            segment_end = min(segment_end, stops[0])
+        yield step, segment_end
+        step = segment_end
+
+
+class SimulationWorker(threading.Thread):
+    """Computes requested steps of one connection, so connection thread can serve messages in the meantime.
+
+    Steps are sent in chunks (see `GuiConnection.simulate_chunk`), so client receives data while simulation is running.
+    """
+
+    def __init__(self, connection: 'GuiConnection'):
+        super().__init__(name=f'nengo_3d simulation {connection.addr}', daemon=True)
+        self.connection = connection
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        with self.connection.sim_lock:
+            self.connection.steps_available.notify()
+
+    def run(self) -> None:
+        connection = self.connection
+        while not self._stop_event.is_set():
+            with connection.sim_lock:
+                request = None  # client request served by work, answered with error if work fails
+                if connection.queued_steps and connection.has_credit() and not connection.cancel.is_set():
+                    work = connection.simulate_chunk
+                    request = connection.queued_steps[0]
+                elif connection.pacer and not connection.cancel.is_set():
+                    delay = connection.pacer.delay()
+                    if delay > 0:
+                        connection.steps_available.wait(timeout=min(delay, 0.1))
+                        continue
+                    work = connection.live_tick
+                    request = connection.live
+                elif connection.should_run_ahead():
+                    work = connection.run_ahead_chunk
+                else:
+                    connection.steps_available.wait(timeout=0.1)
+                    continue
+                try:
+                    work()
+                except Exception as e:
+                    logger.exception(f'Simulation failed in {work.__name__}', exc_info=e)
+                    try:
+                        connection.simulation_failed(request, e)
+                    except (ConnectionError, RuntimeError) as send_error:
+                        logger.warning(f'Failure was not reported to client: {send_error}')
+
+
 class GuiConnection(Connection):
-    def __init__(self, client_socket: socket.socket, addr, server: 'GUI', model: nengo.Network):
-        super().__init__(client_socket, addr, server)
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, server: 'GUI',
+                 model: nengo.Network):
+        super().__init__(reader, writer, server)
         self.vocab = {}
         self.vocab_v2 = {}
+        self.vocab_matrices: dict[int, tuple[object, int, np.ndarray]] = {}
+        """Transposed vectors of vocabularies for similarity, see schemas.SimulationSteps"""
+        self.ever_top_k: dict[tuple[str, str], set[int]] = defaultdict(set)
+        """(node_name, access_path): vocabulary keys that were among top k since reset, see schemas.Observe.top_k"""
         self.server: GUI
         self.scheduled_plots: dict[int, list[ScheduledPlot]] = defaultdict(list)
         self.requested_probes: dict[nengo.base.NengoObject, list[RequestedProbes]] = defaultdict(list)
@@ -56,6 +152,84 @@ class GuiConnection(Connection):
         self.name_finder = NameFinder(terms=self.server.locals, model=model)
         self.sim: nengo.Simulator = None
         """Generate uuid for each model element"""
+        self.history_start = 0
+        """First step recorded by probes of current simulator, later than 0 if it was resumed from checkpoint"""
+        self.history: Optional[ProbeHistory] = None
+        """Probe data of current simulator, rows are dropped after they were sent (see GUI.probe_history)"""
+        self.checkpoints: Optional[CheckpointStore] = None
+        self.previous_checkpoints: Optional[BuildCheckpoints] = None
+        """Checkpoints of simulator discarded on last reset, rebuilt simulator can resume from them"""
+        self.build_seed = int(np.random.randint(nengo.utils.numpy.maxint))
+        """Seed of unseeded model (`network.seed` is None). nengo takes encoders, gains, biases and decoders from the
+        network seed, so every build of the connection is the same network and can resume from previous checkpoints"""
+        self.probes: dict[tuple, nengo.Probe] = {}
+        """Every probe added to the model by (target, attr, sample_every, synapse). Probes are never removed, so
+        changing observed set back and forth does not require new build"""
+        self.sim_key: Optional[tuple] = None
+        """Model fingerprint, probe set, dt and simulator options of current simulator"""
+        self.simulator_options: SimulatorOptions = self.server.simulator_options
+        """Applied on next build, client can change them on reset"""
+        self.build_cache_hits = 0
+        self.build_cache_misses = 0
+        self.shared_memory: Optional[nengo_3d_shm.SharedMemoryRing] = None
+        self.flow_control = False
+        """Simulate and send steps only while client granted credit, see schemas.Credit"""
+        self.credit_frames = 0
+        self.credit_bytes = 0
+        self.chunk_steps = 0
+        """Send at most chunk_steps steps in one message, 0 for no limit"""
+        self.chunk_time = 0.0
+        """Send computed steps at least every chunk_time milliseconds, 0 for no limit"""
+        self.segment_steps = 50
+        """Longest `sim.run_steps` call, cancel and chunk_time are checked between calls"""
+        self.queued_steps: deque[dict] = deque()
+        """Step requests waiting for simulation worker"""
+        self.lookahead_steps = 0
+        """Simulate up to this many steps after the last request before they are requested, 0 disables run ahead"""
+        self.lookahead_bytes = 0
+        """Memory budget of run ahead buffer, 0 for no limit"""
+        self.run_ahead: deque[RunAheadFrame] = deque()
+        """Steps simulated ahead, they are the next steps to send. Simulator is ahead of client by these steps"""
+        self.last_request: Optional[dict] = None
+        """The last step request, run ahead continues after it"""
+        self.pacer: Optional[Pacer] = None
+        """Schedule of real-time playback started by 'play' request, steps are pushed without further requests"""
+        self.live: Optional[dict] = None
+        """The 'play' request, its request_id is in pushed steps"""
+        self.live_sent = 0
+        """Steps before it were pushed or skipped during real-time playback"""
+        self.sim_lock = threading.RLock()
+        """Guards simulator, probes and queued steps. Held by simulation worker while it computes a chunk"""
+        self.steps_available = threading.Condition(self.sim_lock)
+        self.cancel = threading.Event()
+        """Set without waiting for sim_lock, running chunk is interrupted on next recorded step"""
+        self.sweep: Optional[SweepRunner] = None
+        self._send_lock = threading.RLock()
+        """Held by send_binary too, shared memory ring has single producer"""
+        self.worker = SimulationWorker(self)
+        if self.server.broadcast:
+            self.server.broadcast.join(self)
+
+    @property
+    def subscriber(self) -> bool:
+        """Only shows output of simulation controlled by other connection (see GUI.broadcast)"""
+        return self.server.broadcast is not None and self.server.broadcast.is_subscriber(self)
+
+    @property
+    def broadcasting(self) -> bool:
+        return self.server.broadcast is not None and self.server.broadcast.controller is self
+
+    def on_connect(self) -> None:
+        self.worker.start()
+
+    def message_received(self, msg: str):
+        try:
+            incoming_message: dict = message.loads(msg)
+        except json.JSONDecodeError:
+            return  # reported by handle_message
+        data = incoming_message.get('data') or {}
+        if incoming_message.get('schema') == schemas.Simulation.__name__ and data.get('action') in {'stop', 'reset'}:
+            self.cancel.set()  # do not wait until running chunk and messages queued before are handled
 
     def handle_message(self, msg: str):
         super().handle_message(msg)
@@ -63,21 +237,140 @@ class GuiConnection(Connection):
         try:
             incoming_message: dict = message.loads(msg)
             data = incoming_message.get('data') or {}
-            if incoming_message['schema'] == schemas.NetworkSchema.__name__:
-                self.handle_network(data)
-            elif incoming_message['schema'] == schemas.Observe.__name__:
-                self.handle_observe(data)
-            elif incoming_message['schema'] == schemas.Simulation.__name__:
-                self.handle_simulation(data)
-            elif incoming_message['schema'] == schemas.PlotLines.__name__:
-                self.handle_plot_lines(data)
-            else:
-                logger.error(f'Unknown schema: {incoming_message["schema"]}')
+            with self.sim_lock:
+                self._dispatch(incoming_message['schema'], data)
+                self.steps_available.notify()
         except json.JSONDecodeError:
             logger.error(f'Invalid json message: {msg}')
         except Exception as e:
             logger.exception(f'Failed executing: {msg}', exc_info=e)
 
+    def _dispatch(self, schema: str, data: dict):
+        if self.subscriber and schema in {schemas.Observe.__name__, schemas.Simulation.__name__,
+                                          schemas.PlotLines.__name__, schemas.Sweep.__name__}:
+            logger.debug(f'{self.addr} is subscriber, ignored {schema}')
+            return
+        if schema == schemas.Handshake.__name__:
+            self.handle_handshake(data)
+        elif schema == schemas.NetworkSchema.__name__:
+            self.handle_network(data)
+        elif schema == schemas.Observe.__name__:
+            self.handle_observe(data)
+            self.invalidate_run_ahead(data['dt'])
+        elif schema == schemas.Simulation.__name__:
+            self.handle_simulation(data)
+        elif schema == schemas.PlotLines.__name__:
+            self.handle_plot_lines(data)
+        elif schema == schemas.Credit.__name__:
+            self.handle_credit(data)
+        elif schema == schemas.Sweep.__name__:
+            self.handle_sweep(data)
+        else:
+            logger.error(f'Unknown schema: {schema}')
+
+    def handle_handshake(self, incoming_message):
+        schema = schemas.Handshake()
+        handshake = schema.load(data=incoming_message)
+        method = handshake.get('compression', 'none')
+        if method not in nengo_3d_frames.CODECS:
+            logger.warning(f'Unsupported compression: {method}, sending uncompressed')
+            method = 'none'
+        self.compression = nengo_3d_frames.Compression(
+            method=method,
+            level=handshake.get('compression_level', self.compression.level),
+            threshold=handshake.get('compression_threshold', self.compression.threshold))
+        logger.info(f'{self.addr} compression: {self.compression}')
+        if self.shared_memory:
+            self.shared_memory.close()
+            self.shared_memory = None
+        if handshake.get('shared_memory') and not self.subscriber:  # broadcast frames are sent through socket
+            try:
+                self.shared_memory = nengo_3d_shm.SharedMemoryRing.create(handshake['shared_memory_size'])
+            except (OSError, ValueError) as e:
+                logger.warning(f'Shared memory is not available: {e}')
+            else:
+                logger.info(f'{self.addr} shared memory: {self.shared_memory.name}, '
+                            f'{self.shared_memory.capacity / 1024 / 1024:.1f}Mb')
+        # subscribers do not slow down simulation, they drop frames when they fall behind
+        self.flow_control = handshake.get('credit_frames', 0) > 0 and not self.subscriber
+        self.credit_frames = handshake.get('credit_frames', 0) if self.flow_control else 0
+        self.credit_bytes = handshake.get('credit_bytes', 0) if self.flow_control else 0
+        self.chunk_steps = handshake.get('chunk_steps', 0)
+        self.chunk_time = handshake.get('chunk_time', 0.0)
+        self.lookahead_steps = handshake.get('lookahead_steps', 0)
+        self.lookahead_bytes = handshake.get('lookahead_bytes', 0)
+        if self.flow_control:
+            logger.info(f'{self.addr} flow control: {self.credit_frames} frames, '
+                        f'{self.credit_bytes / 1024 / 1024:.1f}Mb, chunks of {self.chunk_steps} steps')
+        self.send_handshake()
+
+    def send_handshake(self):
+        answer = message.dumps({'schema': schemas.Handshake.__name__,
+                                'data': schemas.Handshake().dump({'compression': self.compression.method,
+                                                     'compression_level': self.compression.level,
+                                                     'compression_threshold': self.compression.threshold,
+                                                     'shared_memory': bool(self.shared_memory),
+                                                     'shared_memory_name': self.shared_memory.name
+                                                     if self.shared_memory else None,
+                                                     'credit_frames': self.credit_frames,
+                                                     'credit_bytes': self.credit_bytes,
+                                                     'chunk_steps': self.chunk_steps,
+                                                     'chunk_time': self.chunk_time,
+                                                     'lookahead_steps': self.lookahead_steps,
+                                                     'lookahead_bytes': self.lookahead_bytes,
+                                                     'subscriber': self.subscriber})})
+        self.sendall(answer.encode('utf-8'))
+
+    def handle_credit(self, incoming_message):
+        credit = schemas.Credit().load(data=incoming_message)
+        self.credit_frames += credit['frames']
+        self.credit_bytes += credit['bytes']
+
+    def has_credit(self) -> bool:
+        return not self.flow_control or (self.credit_frames > 0 and self.credit_bytes > 0)
+
+    def on_disconnect(self) -> None:
+        super().on_disconnect()
+        self.worker.stop()
+        if self.worker.is_alive():
+            self.worker.join()
+        if self.sweep:
+            self.sweep.stop()
+        if self.server.broadcast:
+            controller = self.server.broadcast.leave(self)
+            if controller:
+                logger.info(f'{controller.addr} controls simulation now')
+                controller.send_handshake()
+        if self.shared_memory:
+            self.shared_memory.close()
+            self.shared_memory = None
+
+    def handle_sweep(self, incoming_message: dict):
+        sweep = schemas.Sweep().load(data=incoming_message)
+        if self.sweep:
+            self.sweep.stop()
+            self.sweep = None
+        if sweep.get('action', 'start') == 'stop':
+            return
+        if not self.server.model_factory or not self.server.sweep:
+            logger.error('Sweep requires GUI(model_factory=..., sweep=[...])')
+            return
+        # names known to client can come from local variables, runs know only names found from model
+        canonical_names = NameFinder(terms={'model': self.model}, model=self.model)
+        probes = []
+        for observe in sweep.get('observe', []):
+            if observe['access_path'].endswith('similarity'):
+                logger.warning(f'Similarity is not supported in sweep: {observe["source"]}.{observe["access_path"]}')
+                continue
+            obj = self.name_finder.object(name=observe['source'])
+            probes.append(SweepProbe(observe['source'], observe['access_path'], canonical_names.name(obj),
+                                     observe.get('precision', 'float64')))
+        self.sweep = SweepRunner(self, sweep.get('request_id'), probes, until=sweep['until'],
+                                 dt=sweep.get('dt', 0.001), sample_every=sweep.get('sample_every', 1),
+                                 chunk_steps=self.chunk_steps or 1000)
+        logger.info(f'Sweep of {len(self.server.sweep)} runs, {len(probes)} probes, {sweep["until"]} steps')
+        self.sweep.start()
+
     def handle_network(self, incoming_message):
         if isinstance(self.model, nengo.spa.SPA):  # legacy nengo.spa
             for dim, module in self.model._modules.items():
@@ -116,6 +409,9 @@ class GuiConnection(Connection):
                      'modules': getattr(self.model, '_modules', []), 'vocab': self.vocab, 'vocab_v2': self.vocab_v2})
         answer = message.dumps({'schema': schemas.NetworkSchema.__name__, 'data': data_scheme.dump(self.model)})
         self.sendall(answer.encode('utf-8'))
+        if self.subscriber:
+            # client resets its cache when it receives model, history must come after it
+            self.server.broadcast.subscribe(self)
 
     def handle_plot_lines(self, incoming_message: dict):
         schema = schemas.PlotLines()
@@ -134,7 +430,6 @@ class GuiConnection(Connection):
         # module = observe['module']
         dt = observe['dt']
         obj = self.name_finder.object(name=observe['source'])
-        # todo avoid duplicated probes
         if 'probeable' in access_path:
             # special case is probeable values
             if access_path[-1] == 'similarity':
@@ -161,11 +456,10 @@ class GuiConnection(Connection):
                             f'Can not compute similarity for {to_probe} - there is no vocabulary associated with it')
                         return
 
-                with self.model:
-                    probe = nengo.Probe(to_probe, attr=attr, sample_every=sample_every * dt,
-                                        synapse=0.01)  # todo check data shape
-
-                rp = RequestedProbes(probe, observe['access_path'], to_probe, attr)
+                probe = self.probe(to_probe, attr, sample_every * dt)
+                rp = RequestedProbes(probe, observe['access_path'], to_probe, attr,
+                                     observe.get('precision', 'float64'),
+                                     observe.get('top_k', 0) if use_similarity else 0)
                 logger.debug(f'Added to observation: {rp}')
                 self.requested_probes[obj].append(rp)
         else:
@@ -174,62 +468,407 @@ class GuiConnection(Connection):
             # assert len(paths) == len(access_path), (paths, access_path)
             logger.warning(f'Not supported yet: {observe}')
 
+    def probe(self, target: nengo.base.NengoObject, attr: str, sample_every: float) -> nengo.Probe:
+        """Probe of target, added to the model on first use and reused by next builds"""
+        key = (target, attr, sample_every, 0.01)
+        probe = self.probes.get(key)
+        if probe is None:
+            with self.model:
+                probe = nengo.Probe(target, attr=attr, sample_every=sample_every, synapse=0.01)  # todo check data shape
+            self.probes[key] = probe
+        return probe
+
+    def probe_outputs(self, sample_every: float):
+        """Probe decoded outputs of all ensembles and outputs of all nodes before build, so observing other objects
+        with the same sample_every reuses built simulator (see build_key). Neurons are probed only when observed, there
+        are usually many more of them than of decoded dimensions"""
+        for obj, attr in [*((ens, 'decoded_output') for ens in self.model.all_ensembles),
+                          *((node, 'output') for node in self.model.all_nodes)]:
+            if obj.size_out > 0:  # nothing to probe, e.g. node whose function returns None
+                self.probe(obj, attr, sample_every)
+
     def handle_simulation(self, incoming_message):
         schema = schemas.Simulation()
         sim = schema.load(data=incoming_message)
         dt = sim['dt']
         if sim['action'] == 'reset':
-            del self.sim
-            self.sim = None
+            if self.server.probe_outputs:  # before anything is reset, so failed probe leaves previous state intact
+                self.probe_outputs(sim['sample_every'] * dt)
+            self.stop_live()
+            self.queued_steps.clear()
+            self.cancel.clear()
+            self.run_ahead.clear()
+            self.last_request = None
             observes = sim['observe']
-            for probes in self.requested_probes.values():
-                for probe in probes:
-                    self.model.all_probes.remove(probe.probe)
             self.requested_probes.clear()
+            self.ever_top_k.clear()
             for observe in observes:
                 self.handle_observe(observe)
             plot_lines = sim['plot_lines']
             self.scheduled_plots.clear()
             for plot in plot_lines:
                 self.handle_plot_lines(plot)
+            if sim.get('simulator'):
+                self.simulator_options = self.simulator_options._replace(**sim['simulator'])
+            self.reset_simulator(dt)
+            if self.broadcasting:
+                self.server.broadcast.reset()
+                self.publish(self._simulation_stopped(None))
         elif sim['action'] == 'stop':
-            logger.warning('Not implemented')
+            self.stop_live()
+            self.queued_steps.clear()
+            self.cancel.clear()
+            self.invalidate_run_ahead(dt)  # simulator goes back to the last step that client received
+            self.last_request = None
+            self.send_simulation_stopped(sim.get('request_id'))
+        elif sim['action'] == 'seek':
+            self.stop_live()
+            self.queued_steps.clear()
+            self.cancel.clear()
+            self.run_ahead.clear()
+            self.last_request = None
+            self.seek(sim['until'], sim['sample_every'], dt)
+            self.send_simulation_stopped(sim.get('request_id'))
         elif sim['action'] == 'step':
+            assert sim['sample_every'] > 0, sim
+            self.queued_steps.append(sim)
+            self.last_request = sim
+        elif sim['action'] == 'play':
+            self.queued_steps.clear()
+            self.invalidate_run_ahead(dt)
+            self.last_request = None
             if not self.sim:
-                self.sim = nengo.Simulator(network=self.model, dt=dt)
+                self.build_simulator(dt)
+            self.live = sim
+            self.live_sent = self.sim.n_steps
+            self.pacer = Pacer(rate=sim.get('rate', 1.0), fps=sim.get('fps', 24.0), dt=dt,
+                               sample_every=sim['sample_every'], start_step=self.sim.n_steps)
+            logger.info(f'Real-time playback from step {self.sim.n_steps}, {self.pacer.rate} simulated seconds per '
+                        f'second, {self.pacer.frame_steps} steps per frame')
+        else:
+            logger.warning('Unknown field value')
 
-            until = sim['until'] - sim['until'] % sim['sample_every']
-            steps = list(range(self.sim.n_steps, until))
-            if not len(steps) >= 1:
-                logger.warning(f'Requested step: {sim["until"]}, but {self.sim.n_steps} is already computed')
-                return
-            for s in steps:
-                self._handle_scheduled_plots(s)
-                self.sim.step()  # todo this can be done async
-            sample_every = sim['sample_every']
-            assert sample_every > 0, sim
-            if sample_every != 1:
-                recorded_steps = steps[::sample_every]  # todo
-            else:
-                recorded_steps = steps
-            data_scheme = schemas.SimulationSteps(
-                many=True,
-                context={'sim': self.sim,
-                         'model': self.model,
-                         'vocab': self.vocab if self.vocab else self.vocab_v2,
-                         'name_finder': self.name_finder,
-                         'recorded_steps': recorded_steps,
-                         'sample_every': sample_every,
-                         'requested_probes': self.requested_probes,
-                         })
+    def stop_live(self):
+        if self.pacer:
+            logger.info(f'Real-time playback stopped at step {self.sim.n_steps if self.sim else 0}, '
+                        f'{self.pacer.skipped_steps} steps were skipped')
+        self.pacer = None
+        self.live = None
+
+    def simulation_failed(self, request: Optional[dict], error: Exception):
+        """Answer the request whose simulation failed with error, other queued requests are kept"""
+        if request is None:
+            # run-ahead was not requested by client, stop it until next request
+            self.run_ahead.clear()
+            self.last_request = None
+            return
+        if self.queued_steps and self.queued_steps[0] is request:
+            self.queued_steps.popleft()
+        if self.live is request:
+            self.stop_live()
+        self.sendall(self._simulation_stopped(request.get('request_id'), error=f'{type(error).__name__}: {error}'))
+
+    def send_simulation_stopped(self, request_id: Optional[int]):
+        logger.info(f'Simulation stopped at step {self.delivered_steps}')
+        self.sendall(self._simulation_stopped(request_id))
+        # after seek subscribers receive recomputed steps again
+        self.publish(self._simulation_stopped(None))
+
+    def _simulation_stopped(self, request_id: Optional[int], error: Optional[str] = None) -> bytes:
+        step = self.delivered_steps
+        return message.dumps({'schema': schemas.SimulationStopped.__name__,
+                              'request_id': request_id,
+                              'data': schemas.SimulationStopped().dump({'step': step, 'error': error})}
+                             ).encode('utf-8')
+
+    def send_build_report(self, report: dict):
+        answer = message.dumps({'schema': schemas.BuildReport.__name__,
+                                'data': schemas.BuildReport().dump(report)}).encode('utf-8')
+        self.sendall(answer)
+        self.publish(answer, history=False)
+
+    def publish(self, frame: bytes, history: bool = True):
+        """Send output of simulation to subscribers. Frame must not contain request_id of this connection"""
+        if self.broadcasting:
+            self.server.broadcast.publish(frame, history)
+
+    def _object_name(self, obj: nengo.base.NengoObject) -> str:
+        try:
+            return self.name_finder.name(obj)
+        except KeyError:  # object created by network builder, e.g. in nengo.spa modules
+            return str(obj)
+
+    def build_key(self, dt: float) -> tuple:
+        # progress bar does not change built simulator
+        return model_fingerprint(self.model), frozenset(self.probes.values()), dt, \
+               self.simulator_options._replace(progress_bar=False)
+
+    def reset_simulator(self, dt: float):
+        """Reuse built simulator if it already has all observed probes, otherwise it is built on next step"""
+        if self.sim and self.sim_key == self.build_key(dt):
+            self.build_cache_hits += 1
+            logger.info(f'Build cache hit, simulator reset without build '
+                        f'({self.build_cache_hits} hits, {self.build_cache_misses} builds)')
+            with signal_precision(self.simulator_options.dtype):
+                self.sim.reset()
+            self.history.clear()
+            self.history_start = 0
+            return
+        if self.sim:
+            self.previous_checkpoints = self.checkpoints.detach()  # simulator is released, signals are kept
+        del self.sim
+        self.sim = None
+        self.history = None
+        self.checkpoints = None
+
+    def build_simulator(self, dt: float):
+        options = self.simulator_options
+        start = time.perf_counter()
+        model = TimedModel(dt=dt, label=f'{self.model}, dt={dt:f}',
+                           decoder_cache=ReportingDecoderCache(cache_dir=self.server.decoder_cache_dir))
+        with network_seed(self.model, options.seed, default=self.build_seed) as seed, signal_precision(options.dtype):
+            self.sim = nengo.Simulator(network=self.model, dt=dt, seed=seed + 1, model=model,
+                                       progress_bar=options.progress_bar, optimize=options.optimize)
+        build_time = time.perf_counter() - start
+        if self.previous_checkpoints and self.previous_checkpoints.seed != seed:
+            # other encoders, gains and decoders, previous checkpoints can not be restored
+            self.previous_checkpoints = None
+        self.sim_key = self.build_key(dt)
+        self.build_cache_misses += 1
+        logger.info(f'Simulator built in {build_time:.2f}s ({options.dtype}, optimize={options.optimize}, '
+                    f'build seed={seed}), {len(self.probes)} probes '
+                    f'({self.build_cache_hits} hits, {self.build_cache_misses} builds), '
+                    f'{len(model.decoder_cache.solved)} decoders solved')
+        self.send_build_report(build_report(model, name=self._object_name, total_time=build_time))
+        self.history_start = 0
+        self.history = ProbeHistory(self.sim, keep=self.server.probe_history)
+        self.checkpoints = CheckpointStore(self.sim, every=self.server.checkpoint_every,
+                                           memory_budget=self.server.checkpoint_memory, history=self.history)
+        self.checkpoints.save()
+
+    def seek(self, step: int, sample_every: int, dt: float):
+        """Continue simulation from the latest checkpoint at or before step"""
+        if not self.sim:
+            self.build_simulator(dt)
+        own = self.checkpoints.nearest(step, sample_every) or self.checkpoints.checkpoints[0]
+        previous = self.previous_checkpoints.nearest(step, sample_every) if self.previous_checkpoints else None
+        if previous and previous.step > own.step and self.previous_checkpoints.dt == dt:
+            # new probes record from the checkpoint, earlier steps are not available for them
+            clear_probes(self.sim)
+            self.history.clear()
+            self.previous_checkpoints.restore_into(self.sim, previous)
+            self.history_start = previous.step
+            self.checkpoints = CheckpointStore(self.sim, every=self.server.checkpoint_every,
+                                               memory_budget=self.server.checkpoint_memory, history=self.history)
+            self.checkpoints.save()
+        else:
+            if own.step > self.sim.n_steps:
+                # jump forward to the state from before reset, probes did not record steps in between
+                clear_probes(self.sim)
+                self.history.clear()
+                self.history_start = own.step
+            self.checkpoints.restore(own)
+        logger.info(f'Seek to step {step}, resumed from checkpoint at step {self.sim.n_steps}')
+
+    def simulate_chunk(self):
+        """Compute next chunk of first queued step request and send it.
+
+        Chunk ends after `chunk_steps` steps, `chunk_time` milliseconds or on `cancel`, always on a recorded step, so
+        every chunk starts with a recorded step. Steps computed before cancel are still sent.
+        """
+        sim = self.queued_steps[0]
+        if not self.sim:
+            self.build_simulator(sim['dt'])
+        request_id = sim.get('request_id')
+        sample_every = sim['sample_every']
+        until = sim['until'] - sim['until'] % sample_every
+        if self.run_ahead and self.run_ahead[0].sample_every == sample_every and \
+                sim.get('encoding', 'binary') == 'binary':
+            # answered without simulation
+            frame = self.run_ahead.popleft()
+            complete = frame.end >= until
+            if complete:
+                self.queued_steps.popleft()
+            self.send_blocks(frame.blocks, list(range(frame.start, frame.end)), request_id, complete)
+            return
+        self.invalidate_run_ahead(sim['dt'])
+        start = self.sim.n_steps
+        self._simulate(start, self._chunk_until(start, until, sample_every), sample_every, request_id)
+        steps = list(range(start, self.sim.n_steps))
+        complete = self.sim.n_steps >= until
+        if complete:
+            self.queued_steps.popleft()
+        if not steps:
+            # answer anyway, client waits for every request
+            logger.warning(f'Requested step: {sim["until"]}, but {self.sim.n_steps} is already computed')
+        self.send_simulation_steps(steps, sample_every, sim.get('encoding', 'binary'), request_id, complete)
+
+    def _chunk_until(self, start: int, until: int, sample_every: int) -> int:
+        if not self.chunk_steps:
+            return until
+        chunk = max(self.chunk_steps - self.chunk_steps % sample_every, sample_every)
+        return min(until, start + chunk)
+
+    def _simulate(self, start: int, until: int, sample_every: int, request_id: Optional[int],
+                  deadline: Optional[float] = None):
+        """Simulate from start (current step) to until, stop earlier on recorded step after deadline (default
+        chunk_time from now) or cancel"""
+        if deadline is None and self.chunk_time:
+            deadline = time.perf_counter() + self.chunk_time / 1000
+        segment = max(self.segment_steps - self.segment_steps % sample_every, sample_every)
+        every = self.checkpoints.every
+        stops = set(self.scheduled_plots).union(range(start - start % every + every, until, every))
+        for segment_start, segment_end in run_segments(start, until, stops, segment):
+            if segment_start > start and segment_start % sample_every == 0 and (
+                    self.cancel.is_set() or deadline and time.perf_counter() >= deadline):
+                break
+            self._handle_scheduled_plots(segment_start, request_id)
+            self.sim.run_steps(segment_end - segment_start, progress_bar=False)
+            if self.checkpoints.due():
+                self.checkpoints.save()
+
+    def live_tick(self):
+        """Simulate up to the step due by wall clock and push new steps, see `pacing.Pacer`.
+
+        When simulation fell behind schedule or client has no credit, only the newest steps are pushed.
+        """
+        pacer = self.pacer
+        play = self.live
+        request_id = play.get('request_id')
+        sample_every = pacer.sample_every
+        until = play.get('until') or 0
+        until -= until % sample_every
+        now = time.perf_counter()
+        target = min(pacer.target(now), until) if until else pacer.target(now)
+        if target > self.sim.n_steps:
+            # leave part of frame for sending
+            self._simulate(self.sim.n_steps, target, sample_every, request_id, deadline=now + pacer.period * 0.8)
+        step = self.sim.n_steps
+        now = time.perf_counter()
+        behind = pacer.lag(step, now) > pacer.period
+        if pacer.tick(step, now):
+            logger.warning(f'Simulation can not keep up with {pacer.rate} simulated seconds per second, '
+                           f'real-time playback continues from step {step}')
+        if step <= self.live_sent or not self.has_credit():
+            return  # steps are pushed with next frame
+        # one late frame is still sent whole
+        keep = sample_every if behind else 2 * pacer.frame_steps
+        start = max(self.live_sent, step - keep - (step - keep) % sample_every)
+        pacer.skipped_steps += start - self.live_sent
+        complete = bool(until) and step >= until
+        self.send_simulation_steps(list(range(start, step)), sample_every, play.get('encoding', 'binary'),
+                                   request_id, complete)
+        self.live_sent = step
+        if complete:
+            self.stop_live()
+
+    @property
+    def delivered_steps(self) -> int:
+        """Steps sent to client, simulator is ahead of it by run ahead buffer"""
+        if self.run_ahead:
+            return self.run_ahead[0].start
+        return self.sim.n_steps if self.sim else 0
+
+    def should_run_ahead(self) -> bool:
+        last = self.last_request
+        if not self.lookahead_steps or not self.sim or not last or self.queued_steps or self.cancel.is_set():
+            return False
+        if last.get('encoding', 'binary') != 'binary':
+            return False
+        if self.lookahead_bytes and sum(frame.nbytes for frame in self.run_ahead) >= self.lookahead_bytes:
+            return False
+        return self.sim.n_steps < last['until'] - last['until'] % last['sample_every'] + self.lookahead_steps
+
+    def run_ahead_chunk(self):
+        """Simulate next chunk after the last request before client asks for it, see lookahead_steps"""
+        last = self.last_request
+        sample_every = last['sample_every']
+        start = self.sim.n_steps
+        until = last['until'] - last['until'] % sample_every + self.lookahead_steps
+        until -= until % sample_every
+        self._simulate(start, self._chunk_until(start, until, sample_every), sample_every, None)
+        steps = list(range(start, self.sim.n_steps))
+        if not steps:
+            return
+        blocks = self._steps_schema(steps, sample_every).get_blocks(self.sim.data)
+        self.history_sent(steps)
+        self.run_ahead.append(RunAheadFrame(start, self.sim.n_steps, sample_every, blocks,
+                                            sum(block.nbytes for _, block in blocks)))
+
+    def invalidate_run_ahead(self, dt: float):
+        """Drop steps simulated ahead and go back to the last sent step (or the nearest checkpoint before it)"""
+        if not self.run_ahead:
+            return
+        frame = self.run_ahead[0]
+        self.run_ahead.clear()
+        self.seek(frame.start, frame.sample_every, dt)
+
+    def _steps_schema(self, steps: list[int], sample_every: int) -> schemas.SimulationSteps:
+        if sample_every != 1:
+            recorded_steps = steps[::sample_every]  # todo
+        else:
+            recorded_steps = steps
+        return schemas.SimulationSteps(
+            many=True,
+            context={'sim': self.sim,
+                     'model': self.model,
+                     'vocab': self.vocab if self.vocab else self.vocab_v2,
+                     'vocab_matrices': self.vocab_matrices,
+                     'ever_top_k': self.ever_top_k,
+                     'name_finder': self.name_finder,
+                     'recorded_steps': recorded_steps,
+                     'history_start': self.history_start,
+                     'history': self.history,
+                     'sample_every': sample_every,
+                     'requested_probes': self.requested_probes,
+                     })
+
+    def send_simulation_steps(self, steps: list[int], sample_every: int, encoding: str, request_id: Optional[int],
+                              complete: bool = True):
+        data_scheme = self._steps_schema(steps, sample_every)
+        if encoding == 'json':
+            data = data_scheme.dump(self.sim.data)
+            self.history_sent(steps)
             answer = message.dumps({'schema': schemas.SimulationSteps.__name__,
-                                    'data': data_scheme.dump(self.sim.data)})
+                                    'request_id': request_id,
+                                    'complete': complete,
+                                    'data': data}).encode('utf-8')
             logger.debug(f'Sending step {list(nengo_3d.utils.ranges_str(steps))}: {str(answer)[:1000]}')
-            self.sendall(answer.encode('utf-8'))
+            self.sendall(answer)
+            size = len(answer)
+            if self.broadcasting:
+                self.publish(message.dumps({'schema': schemas.SimulationSteps.__name__,
+                                            'data': data}).encode('utf-8'))
+            self.credit_frames -= 1
+            self.credit_bytes -= size
         else:
-            logger.warning('Unknown field value')
+            blocks = data_scheme.get_blocks(self.sim.data)
+            self.history_sent(steps)
+            self.send_blocks(blocks, steps, request_id, complete)
+
+    def history_sent(self, steps: list[int]):
+        """Steps were encoded, rows of probes recorded before them are not needed anymore"""
+        if steps:
+            self.history.sent(steps[-1] + 1 - self.history_start)
+
+    def send_blocks(self, blocks: list[tuple[dict, np.ndarray]], steps: list[int], request_id: Optional[int],
+                    complete: bool = True):
+        """Send SimulationSteps in binary encoding"""
+        parts = nengo_3d_frames.encode_arrays(schema=schemas.SimulationSteps.__name__,
+                                              data={'request_id': request_id, 'complete': complete},
+                                              arrays=blocks)
+        self.send_binary(parts)
+        size = sum(memoryview(part).nbytes for part in parts)
+        logger.debug(f'Sending step {list(nengo_3d.utils.ranges_str(steps))} (request {request_id})')
+        if self.broadcasting:
+            # the same arrays, only header differs
+            self.publish(b''.join(nengo_3d_frames.encode_arrays(schema=schemas.SimulationSteps.__name__,
+                                                                data={'request_id': None, 'complete': True},
+                                                                arrays=blocks)))
+        self.credit_frames -= 1
+        self.credit_bytes -= size
 
-    def _handle_scheduled_plots(self, step):
+    def _handle_scheduled_plots(self, step, request_id: Optional[int] = None):
         plots = self.scheduled_plots.get(step)
         if not plots:
             return
@@ -253,21 +892,63 @@ class GuiConnection(Connection):
                 # 'y': activities.tolist()
             }
             answer = message.dumps({'schema': schemas.PlotLines.__name__,
+                                    'request_id': request_id,
                                     'data': data_scheme.dump(data)})
             logger.debug(f'Sending "{access_path}": {plot.source} at {plot.step}: {str(answer)[:1000]}')
             self.sendall(answer.encode('utf-8'))
+            self.publish(message.dumps({'schema': schemas.PlotLines.__name__,
+                                        'data': data_scheme.dump(data)}).encode('utf-8'))
+
+    def send_binary(self, parts: list[bytes]):
+        """Send binary message through shared memory if possible, otherwise through socket"""
+        with self._send_lock:
+            if self.shared_memory:
+                block = self.shared_memory.write(parts)
+                if block:
+                    position, size = block
+                    answer = message.dumps({'schema': schemas.SharedMemoryBlock.__name__,
+                                            'data': schemas.SharedMemoryBlock().dump({'position': position,
+                                                                                      'size': size})})
+                    self.sendall(answer.encode('utf-8'))
+                    return
+                logger.debug('No space left in shared memory, sending through socket')
+            self.sendall(b''.join(parts))
 
     def sendall(self, msg: bytes):
-        self._socket.sendall(struct.pack("i", len(msg)) + msg)
+        with self._send_lock:  # message handler, simulation worker and sweep all send
+            super().sendall(msg)
 
 
 class GUI(Nengo3dServer):
     connection = GuiConnection
 
     def __init__(self, host: str = 'localhost', port: int = 6001, filename=None, model: Optional[nengo.Network] = None,
-                 local_vars: dict[str, Any] = None, blender_exe: str = 'blender.exe', tag: str = ''):
+                 local_vars: dict[str, Any] = None, blender_exe: str = 'blender.exe', tag: str = '',
+                 checkpoint_every: int = 500, checkpoint_memory: int = 256 * 1024 * 1024,
+                 decoder_cache_dir: Optional[str] = None, simulator_options: Optional[dict[str, Any]] = None,
+                 probe_history: Optional[int] = 0, probe_outputs: bool = False,
+                 model_factory: Optional[Callable[[Any], nengo.Network]] = None, sweep: Sequence[Any] = (),
+                 sweep_workers: Optional[int] = None,
+                 broadcast: bool = False, broadcast_history: int = 256 * 1024 * 1024):
         super().__init__(host, port)
         self.tag = tag
+        self.broadcast = Broadcast(history_bytes=broadcast_history) if broadcast else None
+        """First client controls simulation, other clients show the same simulation (see nengo_3d.broadcast)"""
+        self.model_factory = model_factory
+        """Creates variant of model for every sweep parameter, must be picklable (see nengo_3d.sweep)"""
+        self.sweep = list(sweep)
+        """Parameters of model_factory (e.g. seeds), simulated side by side on request of client"""
+        self.sweep_workers = sweep_workers
+        """Worker processes of sweep, all cores by default"""
+        self.checkpoint_every = checkpoint_every
+        """Save simulator state every n steps, allows to seek and resume simulation after reset"""
+        self.checkpoint_memory = checkpoint_memory
+        """Memory budget for checkpoints of one simulator in bytes"""
+        self.probe_history = probe_history
+        """Recorded rows kept by every probe after they were sent to client, None keeps whole history in memory"""
+        self.probe_outputs = probe_outputs
+        """Probe outputs of all ensembles and nodes, so changing observed objects does not require new build. Costs
+        build and simulation time of large models, whose outputs are mostly not observed"""
         self.blender_exe = blender_exe
         self.locals = local_vars or {}
         if self.locals.get('model') is None:
@@ -276,6 +957,10 @@ class GUI(Nengo3dServer):
             nengo.spa.enable_spa_params(model)
         self.model = model
         self.filename = os.path.realpath(filename) or __file__
+        self.decoder_cache_dir = decoder_cache_dir or default_decoder_cache_dir(self.filename)
+        """Decoders solved for seeded objects are stored here and reused by next builds, also after restart"""
+        self.simulator_options = SimulatorOptions(**(simulator_options or {}))
+        """dtype, optimize, progress_bar and seed of built simulators, see nengo_3d.builder.SimulatorOptions"""
         # self.blender_log = None
         self._blender_subprocess = None
 
@@ -310,7 +995,7 @@ class GUI(Nengo3dServer):
             self._blender_subprocess = subprocess.Popen(command, env=os.environ)
         self.run(connection_init_args={'model': self.model})
         if not skip_blender:
-            if self.stop_now and self._blender_subprocess.poll() is None:
+            if self.stopped_by_signal and self._blender_subprocess.poll() is None:
                 # todo this is not a reliable way to kill blender
                 logger.info(f'Trying to kill Blender...')
                 self._blender_subprocess.kill()
@@ -1,14 +1,20 @@
+"""Asyncio server core.
+
+Every client is served by a task reading frames from `asyncio.StreamReader`. Messages are handled one by one in an
+executor thread of the connection, so handlers can block (e.g. wait for simulation), while the event loop keeps
+reading and writing frames of all connections. Frames can be sent from any thread, see `Connection.sendall`.
+"""
 import argparse
+import asyncio
 import logging
-import select
 import signal
-import socket
-import struct
 import threading
-import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import *
 
+from nengo_3d.nengo_3d_frames import Compression, FRAME_HEADER, decode_frame, encode_frame
+
 logger = logging.getLogger(__file__)
 
 
@@ -18,120 +24,144 @@ class GuiServerSettings:
     port: int = 7000
 
 
-class Connection(threading.Thread):
-    _stop_now = False
+async def read_frame(reader: asyncio.StreamReader) -> Optional[bytes]:
+    """Payload of next frame, None when connection was closed"""
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        size, _, _ = FRAME_HEADER.unpack(header)
+        return decode_frame(header, await reader.readexactly(size))
+    except asyncio.IncompleteReadError:
+        return None
 
-    @classmethod
-    def stop_now(cls):
-        cls._stop_now = True
 
-    def __init__(self, client_socket: socket.socket, addr, server: 'Nengo3dServer', **kwargs):
-        super().__init__()
+class Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, server: 'Nengo3dServer',
+                 **kwargs):
         self.server = server
-        self._socket = client_socket
-        self.addr = addr
-        self.running = True
-
-        self.to_send: Optional[str] = None
-
-    def run(self) -> None:
-        self._socket.setblocking(False)  # to handle terminate signals we can not block, ugh...
-        self._socket.settimeout(1)
+        self._reader = reader
+        self._writer = writer
+        self.addr = writer.get_extra_info('peername')
+        self.compression = Compression()
+        """Compression of sent frames, client can change it on handshake"""
+        self.loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'nengo_3d connection {self.addr}')
+        """Handles messages in order of arrival, outside of event loop"""
+        self.closed = False
+
+    async def serve(self) -> None:
+        self.on_connect()
         try:
-            while self.running and not self._stop_now:
-                try:
-                    size_raw = self._socket.recv(struct.calcsize("i"))
-                except socket.timeout:
-                    continue
-                if not size_raw:
-                    break
-                size = struct.unpack("i", size_raw)[0]
-                data = ""
-                while len(data) < size:
-                    msg = self._socket.recv(size - len(data))
-                    if not msg:
-                        return None
-                    data += msg.decode('utf-8')
-                    logger.debug(f'Incoming: {data}')
-                    self.handle_message(data)
+            while (frame := await read_frame(self._reader)) is not None:
+                msg = str(frame, 'utf-8')
+                self.message_received(msg)
+                self.loop.run_in_executor(self._executor, self.handle_message, msg)
         except (ConnectionAbortedError, ConnectionResetError) as e:
             logger.warning(e)
-        else:
-            self._socket.close()
+        except asyncio.CancelledError:
+            # server is shutting down, release threads waiting in sendall even if client does not read
+            self._writer.transport.abort()
+            raise
         finally:
+            self.closed = True
+            # handlers waiting in queue are dropped, running handler and resources are released outside of loop
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            await asyncio.shield(self.loop.run_in_executor(None, self.on_disconnect))
+            self._writer.close()
             self.server.remove(self)
-        pass
+
+    def on_connect(self) -> None:
+        """Called on event loop before the first message is read"""
+
+    def on_disconnect(self) -> None:
+        """Release resources owned by connection. Runs in executor, can block"""
+
+    def message_received(self, msg: str) -> None:
+        """Called on event loop as soon as message arrives, before it is handled. Must not block"""
 
     def handle_message(self, msg: str) -> None:
         logger.debug(f'{self.addr} incoming: {msg[:1000]}')
 
-    def stop(self):
-        self.running = False
+    def sendall(self, payload: bytes) -> None:
+        """Send payload as one frame. Can be called from any thread except event loop, blocks until frame is handed
+        to transport and its buffer is drained below limit, so fast producer is slowed down by slow client"""
+        if self.closed:
+            raise ConnectionResetError(f'{self.addr} is closed')
+        frame = encode_frame(payload, self.compression)
+        asyncio.run_coroutine_threadsafe(self._write(frame), self.loop).result()
+
+    async def _write(self, frame: bytes) -> None:
+        self._writer.write(frame)
+        await self._writer.drain()
 
 
 class Nengo3dServer:
     connection = Connection
-    _stop_now = False
-
-    @classmethod
-    def stop_now(cls):
-        cls._stop_now = True
 
     def __init__(self, host: str, port: int):
         self.port = port
         self.host = host
         self.connections = []
-        self._running = True
+        self.stopped_by_signal = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop: Optional[asyncio.Event] = None
 
-    @classmethod
-    def exit_gracefully(cls, sig, frame) -> None:
+    def stop(self) -> None:
+        """Stop server and close all connections. Can be called from any thread"""
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    def exit_gracefully(self, sig, frame=None) -> None:
         logger.info(f'Terminating gracefully after signal: {sig}')
-        cls.stop_now()
-        cls.connection.stop_now()
+        self.stopped_by_signal = True
+        self.stop()
+
+    def _install_signal_handlers(self) -> None:
+        if threading.current_thread() is not threading.main_thread():
+            return  # server runs in background, signals are handled by the application
+        for name in ('SIGINT', 'SIGTERM', 'SIGBREAK'):
+            sig = getattr(signal, name, None)
+            if sig is None:
+                continue
+            try:
+                self._loop.add_signal_handler(sig, self.exit_gracefully, sig)
+            except NotImplementedError:  # windows event loops do not support signal handlers
+                signal.signal(sig, self.exit_gracefully)
 
     def remove(self, connection: Connection) -> None:
-        # todo probably requires a lock
         self.connections.remove(connection)
         if not self.connections:
             logger.info('No connections remaining')
-            # self._running = False
 
     def run(self, connection_init_args=None) -> None:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.bind((self.host, self.port))
-        sock.setblocking(False)
-        sock.listen(10)
-
-        # for faster TIME_WAIT
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        asyncio.run(self.serve(connection_init_args or {}))
+
+    async def serve(self, connection_init_args: dict) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._install_signal_handlers()
+        tasks: set[asyncio.Task] = set()
+
+        async def on_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            tasks.add(asyncio.current_task())
+            connection = self.connection(reader, writer, server=self, **connection_init_args)
+            self.connections.append(connection)
+            logger.info(f"New connection from {connection.addr}, all connections: {len(self.connections)}")
+            try:
+                await connection.serve()
+            except asyncio.CancelledError:
+                pass  # server is shutting down
+            finally:
+                tasks.discard(asyncio.current_task())
 
+        server = await asyncio.start_server(on_client, self.host, self.port, reuse_address=True)
         logger.info("Listening on port % s", self.port)
-
-        while self._running and not self._stop_now:
-            try:
-                timeout = 0.1  # Check for a new client every 10th of a second
-                readable, _, _ = select.select([sock], [], [], timeout)
-                if len(readable) > 0:
-                    client_socket, client_address = sock.accept()
-                    non_blocking_connection = self.connection(client_socket, addr=client_address, server=self,
-                                                              **connection_init_args)
-                    non_blocking_connection.start()
-                    self.connections.append(non_blocking_connection)
-                    logger.info(f"New connection from {client_address}, all connections: {len(self.connections)}")
-            except KeyboardInterrupt:
-                break
-
-        for connection in self.connections:
-            connection: Connection
-            connection.stop()
-            connection.join()
+        async with server:
+            await self._stop.wait()
+            server.close()
+            for task in list(tasks):
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
         logger.info("Shutting down server")
-        sock.close()
-
-
-signal.signal(signal.SIGINT, Nengo3dServer.exit_gracefully)
-signal.signal(signal.SIGTERM, Nengo3dServer.exit_gracefully)
-signal.signal(signal.SIGBREAK, Nengo3dServer.exit_gracefully)
 
 
 def parse_cli_args():
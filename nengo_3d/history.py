@@ -0,0 +1,85 @@
+"""Bounded probe history of simulator.
+
+nengo appends every recorded row of a probe to a list (see `probe_data`) and keeps it for the life of the
+simulator. Rows sent to client are not needed by server anymore, so `ProbeHistory` deletes them from the head of the
+list and counts them, rows keep their index and new rows are appended by nengo as usual.
+"""
+import logging
+from collections import defaultdict
+from typing import Optional
+
+import nengo
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def probe_data(sim: nengo.Simulator) -> dict[nengo.Probe, list]:
+    """Lists of recorded rows by probe, `sim._sim_data` in nengo >= 3.0, `sim._probe_outputs` in nengo 2"""
+    data = getattr(sim, '_sim_data', None)
+    return data if data is not None else sim._probe_outputs
+
+
+def clear_probes(sim: nengo.Simulator) -> None:
+    """Drop recorded rows of all probes, `sim.clear_probes()` of nengo >= 3.0"""
+    data = probe_data(sim)
+    for probe in sim.model.probes:
+        data[probe] = []
+    sim.data.reset()
+
+
+class ProbeHistory:
+    """Rows of probes of one simulator, indexed from the first recorded row (see `GuiConnection.history_start`)"""
+
+    def __init__(self, sim: nengo.Simulator, keep: Optional[int] = 0):
+        self.sim = sim
+        self.keep = keep
+        """Rows kept after they were sent, None keeps whole history"""
+        self.dropped: dict[nengo.Probe, int] = defaultdict(int)
+        """Rows deleted from the head of probe data"""
+
+    def _period(self, probe: nengo.Probe) -> int:
+        """Simulation steps per recorded row"""
+        return 1 if probe.sample_every is None else max(int(round(probe.sample_every / self.sim.dt)), 1)
+
+    def length(self, probe: nengo.Probe) -> int:
+        return self.dropped[probe] + len(probe_data(self.sim)[probe])
+
+    def rows(self, probe: nengo.Probe, start: int, end: int) -> np.ndarray:
+        """Rows [start, end) of probe. Rows that were already dropped are nan"""
+        shape = self.sim.model.sig[probe]['in'].shape
+        data = probe_data(self.sim)[probe]
+        dropped = self.dropped[probe]
+        end = min(end, dropped + len(data))
+        kept = data[max(start - dropped, 0):max(end - dropped, 0)]
+        kept = np.asarray(kept) if kept else np.empty((0, *shape))
+        missing = min(dropped, end) - start
+        if missing <= 0:
+            return kept
+        logger.warning(f'Rows {start}-{start + missing} of {probe} were dropped, see GUI.probe_history')
+        return np.concatenate([np.full((missing, *shape), np.nan), kept])
+
+    def truncate(self, probe: nengo.Probe, length: int) -> None:
+        """Drop rows from length on (e.g. restored checkpoint), the next recorded row has index length"""
+        dropped = self.dropped[probe]
+        if length < dropped:
+            probe_data(self.sim)[probe].clear()
+            self.dropped[probe] = length
+        else:
+            del probe_data(self.sim)[probe][length - dropped:]
+
+    def sent(self, steps: int) -> None:
+        """First `steps` steps since the first recorded step were sent, drop their rows except the last `keep`"""
+        if self.keep is None:
+            return
+        for probe in self.sim.model.probes:
+            data = probe_data(self.sim)[probe]
+            drop = steps // self._period(probe) - self.keep - self.dropped[probe]
+            drop = min(drop, len(data))
+            if drop > 0:
+                del data[:drop]
+                self.dropped[probe] += drop
+
+    def clear(self) -> None:
+        """Probe data was cleared (`sim.reset()` or `sim.clear_probes()`)"""
+        self.dropped.clear()
@@ -0,0 +1,288 @@
+"""Framing and binary messages shared by nengo_3d server and bl_nengo_3d addon.
+
+Every message is sent as a frame: `FRAME_HEADER` (payload size on the wire, raw payload size, codec) followed by
+payload. Payload can be compressed, see `Compression`. `FrameReader` reassembles frames on the receiving side.
+
+JSON messages (see `nengo_3d_schemas.Message`) are fine for small control messages, but encoding probe data with
+`.tolist()` costs a python object per element. Binary message carries numpy arrays as raw little endian buffers:
+
+    BINARY_MAGIC | uint32 header size | json header | padding | buffer 0 | buffer 1 | ...
+
+Header is json object ``{'schema': str, 'data': Any, 'arrays': [{'dtype', 'shape', 'offset', **meta}, ...]}``,
+`offset` is counted from the first buffer. Header and every buffer are padded to `ALIGNMENT` bytes.
+"""
+import json
+import logging
+import select
+import socket
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional, Union
+
+import numpy as np
+
+BINARY_MAGIC = b'N3DB'
+ALIGNMENT = 8
+
+FRAME_HEADER = struct.Struct('<IIB')
+"""payload size on the wire, raw (uncompressed) payload size, codec"""
+CODECS = {'none': 0, 'zlib': 1}
+
+_header_size = struct.Struct('<I')
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+logger = logging.getLogger(__name__)
+
+
+def is_binary(payload: Buffer) -> bool:
+    return bytes(payload[:len(BINARY_MAGIC)]) == BINARY_MAGIC
+
+
+def _padding(size: int) -> int:
+    return -size % ALIGNMENT
+
+
+def dumps_arrays(schema: str, data: Any, arrays: Iterable[tuple[dict, np.ndarray]]) -> bytes:
+    """Encode arrays with their metadata (for example node name and access path) into binary message"""
+    return b''.join(encode_arrays(schema, data, arrays))
+
+
+def encode_arrays(schema: str, data: Any, arrays: Iterable[tuple[dict, np.ndarray]]) -> list[Buffer]:
+    """Parts of binary message, without joining them. Allows to copy arrays directly to destination buffer"""
+    entries = []
+    buffers = []
+    for meta, array in arrays:
+        array = np.ascontiguousarray(array)
+        if array.dtype.byteorder == '>':
+            array = array.astype(array.dtype.newbyteorder('<'))
+        entries.append({**meta, 'dtype': array.dtype.str, 'shape': list(array.shape)})
+        buffers.append(array)
+
+    offset = 0
+    for entry, array in zip(entries, buffers):
+        entry['offset'] = offset
+        offset += array.nbytes + _padding(array.nbytes)
+    header = json.dumps({'schema': schema, 'data': data, 'arrays': entries}).encode('utf-8')
+    header_end = len(BINARY_MAGIC) + _header_size.size + len(header)
+
+    parts = [BINARY_MAGIC, _header_size.pack(len(header)), header, b'\0' * _padding(header_end)]
+    for array in buffers:
+        parts.append(array.reshape(-1).view(np.uint8).data)
+        parts.append(b'\0' * _padding(array.nbytes))
+    return parts
+
+
+def loads_arrays(payload: Buffer) -> dict:
+    """Decode binary message. Each entry in header['arrays'] gets 'value': read only view on the payload"""
+    payload = memoryview(payload)
+    start = len(BINARY_MAGIC)
+    assert bytes(payload[:start]) == BINARY_MAGIC, 'Not a binary message'
+    size, = _header_size.unpack_from(payload, start)
+    start += _header_size.size
+    header = json.loads(bytes(payload[start:start + size]).decode('utf-8'))
+    start += size
+    start += _padding(start)
+    for entry in header['arrays']:
+        dtype = np.dtype(entry['dtype'])
+        shape = tuple(entry['shape'])
+        count = int(np.prod(shape, dtype=np.int64))
+        entry['value'] = np.frombuffer(payload, dtype=dtype, count=count, offset=start + entry['offset']).reshape(shape)
+    return header
+
+
+PRECISIONS = ('float64', 'float32', 'float16', 'uint8')
+"""Precision of sent arrays, from the most to the least accurate"""
+UINT8_NAN = 255
+"""Code of NaN in uint8 precision, values are scaled to 0 - 254"""
+
+
+def quantize(array: np.ndarray, precision: str) -> tuple[np.ndarray, dict]:
+    """Lossy encoding of data that is only visualized. Returns encoded array and metadata needed by `dequantize`.
+
+    float16 overflows to inf above 65504. uint8 is scaled to min/max of the whole array (NaN is ignored), so it keeps
+    255 levels between them; min and max are sent in metadata. NaN (e.g. entries outside of top k) is `UINT8_NAN`.
+    """
+    if precision == 'uint8':
+        array = np.asarray(array)
+        nan = np.isnan(array)
+        low = float(np.nanmin(array)) if not nan.all() else 0.0
+        high = float(np.nanmax(array)) if not nan.all() else 0.0
+        scale = (UINT8_NAN - 1) / (high - low) if high > low else 0.0
+        encoded = np.rint((np.where(nan, low, array) - low) * scale).astype(np.uint8)
+        encoded[nan] = UINT8_NAN
+        return encoded, {'precision': precision, 'min': low, 'max': high}
+    if precision in PRECISIONS:
+        return np.asarray(array, dtype=precision), {'precision': precision}
+    raise ValueError(f'Unknown precision: {precision}')
+
+
+def dequantize(array: np.ndarray, meta: dict) -> np.ndarray:
+    """Decode array encoded with `quantize`, always returns new array. Lossy precisions are decoded to float32"""
+    precision = meta.get('precision', 'float64')
+    if precision == 'uint8':
+        low, high = meta['min'], meta['max']
+        value = np.float32(low) + array.astype(np.float32) * np.float32((high - low) / (UINT8_NAN - 1))
+        value[array == UINT8_NAN] = np.nan
+        return value
+    if precision == 'float16':
+        return array.astype(np.float32)
+    return np.array(array)
+
+
+def top_k(array: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Indices (int32) and values of k largest entries of every row of [n, size] array. Both are [n, k], the largest
+    entry first"""
+    k = min(k, array.shape[1])
+    if k == 0 or len(array) == 0:
+        return np.empty((len(array), 0), dtype=np.int32), np.empty((len(array), 0), dtype=array.dtype)
+    indices = np.argpartition(-array, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(array, indices, axis=1)
+    order = np.argsort(-values, axis=1, kind='stable')
+    return np.take_along_axis(indices, order, axis=1).astype(np.int32), np.take_along_axis(values, order, axis=1)
+
+
+def expand_top_k(indices: np.ndarray, values: np.ndarray, size: int, fill: float = np.nan) -> np.ndarray:
+    """Dense [n, size] array from result of `top_k`, entries outside top k are `fill`"""
+    dense = np.full((len(values), size), fill, dtype=np.result_type(values.dtype, np.float32))
+    np.put_along_axis(dense, indices.astype(np.intp), values, axis=1)
+    return dense
+
+
+@dataclass
+class Compression:
+    """Compression of sent frames, agreed per connection with `nengo_3d_schemas.Handshake`"""
+    method: str = 'none'
+    """'none' or 'zlib'"""
+    level: int = 6
+    """zlib compression level, 1 (fast) - 9 (best)"""
+    threshold: int = 4096
+    """Frames smaller than threshold (in bytes) are sent uncompressed"""
+
+    def compress(self, payload: bytes) -> tuple[int, bytes]:
+        if self.method == 'zlib' and len(payload) >= self.threshold:
+            return CODECS['zlib'], zlib.compress(payload, self.level)
+        return CODECS['none'], payload
+
+
+def encode_frame(payload: bytes, compression: Optional[Compression] = None) -> bytes:
+    codec, data = compression.compress(payload) if compression else (CODECS['none'], payload)
+    if codec != CODECS['none']:
+        logger.debug(f'Sending compressed frame: {len(data)}/{len(payload)} bytes ({len(data) / len(payload):.1%})')
+    return FRAME_HEADER.pack(len(data), len(payload), codec) + data
+
+
+def decode_frame(header: Buffer, data: Buffer) -> Buffer:
+    """Payload of frame received in two parts: `FRAME_HEADER` and data (e.g. by `asyncio.StreamReader`)"""
+    size, raw_size, codec = FRAME_HEADER.unpack(header)
+    if codec == CODECS['zlib']:
+        logger.debug(f'Received compressed frame: {size}/{raw_size} bytes ({size / raw_size:.1%})')
+        return zlib.decompress(data, bufsize=raw_size)
+    elif codec != CODECS['none']:
+        raise ValueError(f'Unknown frame codec: {codec}')
+    return data
+
+
+def send_frame(sock: socket.socket, payload: bytes, compression: Optional[Compression] = None) -> None:
+    """Send whole frame, also through non-blocking socket. `sock.sendall` raises there when send buffer is full and
+    part of the frame may already be written, which breaks framing of the receiver"""
+    view = memoryview(encode_frame(payload, compression))
+    while view:
+        try:
+            view = view[sock.send(view):]
+        except BlockingIOError:
+            select.select([], [sock], [])  # server reads frames independently of what it sends
+
+
+class FrameReader:
+    """Receive length prefixed frames with `socket.recv_into` into one preallocated buffer.
+
+    The buffer grows geometrically when a frame does not fit, so receiving big message is linear in its size.
+    Frames returned by `next_frame` are views on the buffer and are valid only until next call of `recv`,
+    copy them if they need to outlive it. Compressed frames are decompressed to new bytes.
+    """
+
+    def __init__(self, sock: socket.socket, initial_size: int = 64 * 1024):
+        self._socket = sock
+        self._buffer = bytearray(initial_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        """First byte that was not handed out as a frame"""
+        self._end = 0
+        """End of received data"""
+        self.wire_bytes = 0
+        """Total size of received payloads, as sent over the network"""
+        self.raw_bytes = 0
+        """Total size of received payloads after decompression"""
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buffer)
+
+    @property
+    def pending(self) -> int:
+        """Number of received bytes that are not handed out yet"""
+        return self._end - self._start
+
+    def _frame_size(self) -> Optional[int]:
+        if self.pending < FRAME_HEADER.size:
+            return None
+        size, _, _ = FRAME_HEADER.unpack_from(self._buffer, self._start)
+        return FRAME_HEADER.size + size
+
+    def _reserve(self, size: int) -> None:
+        """Make sure that frame of `size` bytes fits into buffer after compacting"""
+        pending = self.pending
+        if self._start:
+            self._view[:pending] = self._view[self._start:self._end]
+            self._start, self._end = 0, pending
+        if size > self.capacity:
+            new_buffer = bytearray(max(size, 2 * self.capacity))
+            new_buffer[:pending] = self._buffer[:pending]
+            self._buffer = new_buffer
+            self._view = memoryview(self._buffer)
+
+    def recv(self) -> int:
+        """Receive available data with single `recv_into` call.
+
+        Returns number of received bytes, 0 means that connection was closed by peer.
+        Raises the same exceptions as socket (e.g. `socket.timeout`) when no data is available.
+        """
+        frame_size = self._frame_size()
+        if self._start or self._end == self.capacity or (frame_size and frame_size > self.capacity):
+            self._reserve(max(frame_size or 0, self.pending + 1))
+        received = self._socket.recv_into(self._view[self._end:])
+        self._end += received
+        return received
+
+    def complete_frames(self) -> int:
+        """Number of received frames that were not handed out yet"""
+        count = 0
+        start = self._start
+        while self._end - start >= FRAME_HEADER.size:
+            size, _, _ = FRAME_HEADER.unpack_from(self._buffer, start)
+            start += FRAME_HEADER.size + size
+            if start > self._end:
+                break
+            count += 1
+        return count
+
+    def next_frame(self) -> Optional[memoryview]:
+        """Payload of next complete frame or None if it was not received yet"""
+        frame_size = self._frame_size()
+        if frame_size is None or self.pending < frame_size:
+            return None
+        size, raw_size, codec = FRAME_HEADER.unpack_from(self._buffer, self._start)
+        frame = self._view[self._start + FRAME_HEADER.size:self._start + frame_size]
+        self._start += frame_size
+        if self._start == self._end:
+            self._start = self._end = 0
+        self.wire_bytes += size
+        self.raw_bytes += raw_size
+        if codec == CODECS['zlib']:
+            logger.debug(f'Received compressed frame: {size}/{raw_size} bytes ({size / raw_size:.1%})')
+            frame = memoryview(zlib.decompress(frame, bufsize=raw_size))
+        elif codec != CODECS['none']:
+            raise ValueError(f'Unknown frame codec: {codec}')
+        return frame
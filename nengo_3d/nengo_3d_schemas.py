@@ -3,15 +3,69 @@ from marshmallow import Schema, fields
 
 class Message(Schema):
     schema = fields.Str(required=True)
+    request_id = fields.Int(allow_none=True)
+    """Answers echo request_id of Simulation request that caused them"""
+    complete = fields.Bool(default=True)
+    """False when more answers to the same request will follow"""
     data = fields.Field()
     """Based on schema decode the data field. Data can be any Schema"""
 
 
+class Handshake(Schema):
+    """First message sent by client. Server answers with settings that will be used for this connection"""
+    compression = fields.Str(default='none')
+    """'none' or 'zlib'"""
+    compression_level = fields.Int(default=6)
+    compression_threshold = fields.Int(default=4096)
+    shared_memory = fields.Bool(default=False)
+    """Send simulation steps through shared memory, works only when client and server are on the same machine"""
+    shared_memory_size = fields.Int(default=64 * 1024 * 1024)
+    shared_memory_name = fields.Str(allow_none=True, default=None)
+    """Set by server, name of shared memory to attach to"""
+    credit_frames = fields.Int(default=0)
+    """Initial flow control window in SimulationSteps messages, 0 disables flow control (see Credit)"""
+    credit_bytes = fields.Int(default=0)
+    """Initial flow control window in bytes of SimulationSteps messages (before compression)"""
+    chunk_steps = fields.Int(default=0)
+    """Answer step requests in chunks of at most chunk_steps steps, 0 answers whole request at once"""
+    chunk_time = fields.Float(default=0)
+    """Send computed steps at least every chunk_time milliseconds, 0 answers whole request at once"""
+    lookahead_steps = fields.Int(default=0)
+    """Server keeps simulating up to lookahead_steps after the last step request, so following requests are answered
+    from buffer without waiting for simulation. 0 disables run ahead, binary encoding only"""
+    lookahead_bytes = fields.Int(default=0)
+    """Memory budget of run ahead buffer in bytes, 0 for no limit"""
+    subscriber = fields.Bool(default=False)
+    """Set by broadcasting server: client only receives simulation controlled by other client, its simulation
+    requests are ignored. Server sends handshake again when client takes over control"""
+
+
+class Credit(Schema):
+    """Sent by client when it consumed SimulationSteps messages, allows server to simulate and send more.
+
+    Server spends one frame and message size in bytes for every SimulationSteps message and stops simulating when
+    any of them is used up.
+    """
+    frames = fields.Int(required=True)
+    bytes = fields.Int(required=True)
+
+
+class SharedMemoryBlock(Schema):
+    """Notification about binary message written to shared memory ring (see nengo_3d_shm)"""
+    position = fields.Int(required=True)
+    size = fields.Int(required=True)
+
+
 class Observe(Schema):
     source = fields.Str(required=True, allow_none=False)
     access_path = fields.Str(required=True)
     sample_every = fields.Int(required=True)
     dt = fields.Float(required=True)
+    precision = fields.Str(default='float64')
+    """Precision of sent data: 'float64', 'float32', 'float16' or 'uint8' (see nengo_3d_frames.quantize)"""
+    top_k = fields.Int(default=0)
+    """Similarity access paths only: send k most similar vocabulary keys of every step (see nengo_3d_frames.top_k),
+    0 sends all keys"""
 
 
 class PlotLines(Schema):
@@ -23,19 +77,118 @@ class PlotLines(Schema):
 
 
 class SimulationSteps(Schema):
-    step = fields.Int(strict=True)
-    node_name = fields.Str()
-    parameters = fields.Dict(keys=fields.Str(),
-                             values=fields.List(fields.Field()), default=None)
+    """Block of consecutive steps for one (node_name, access_path)"""
+    node_name = fields.Str(required=True)
+    access_path = fields.Str(required=True)
+    start = fields.Int(strict=True, required=True)
+    """Index of first recorded step in this block"""
+    stride = fields.Int(strict=True, required=True)
+    """Number of simulation steps between recorded steps (sample_every)"""
+    precision = fields.Str(default='float64')
+    min = fields.Float()
+    max = fields.Float()
+    """Range of uint8 precision"""
+    run = fields.Int(allow_none=True, default=None)
+    """Index of sweep run (see Sweep), None for interactive simulation"""
+    top_k = fields.Int()
+    """Block has values of top k keys (Observe.top_k), their indices are in next block with top_k_indices"""
+    size = fields.Int()
+    """Number of vocabulary keys of top k block"""
+    ever_top_k = fields.List(fields.Int())
+    """Keys that were in top k at any step since reset"""
+    top_k_indices = fields.Bool()
+    """Block has [n_steps, k] indices of keys of previous top k block"""
+    data = fields.List(fields.List(fields.Field()))
+    """[n_steps, dims], only in json encoding. Binary encoding sends data as array"""
+
+
+class SimulatorOptions(Schema):
+    """Arguments of built simulator. Missing fields keep server settings"""
+    dtype = fields.Str(default='float64')
+    """'float64' or 'float32' signals"""
+    optimize = fields.Bool(default=True)
+    """Merge operators after build: slower build, faster steps"""
+    progress_bar = fields.Bool(default=True)
+    """Progress bar of build in server console"""
+    seed = fields.Int(allow_none=True, default=None)
+    """Seed of network build (encoders, gains, biases, decoders), None keeps seed of the model"""
 
 
 class Simulation(Schema):
+    request_id = fields.Int(allow_none=True, default=None)
+    """Chosen by client, echoed in answers. Allows many requests in flight"""
     action = fields.Str()
+    """'reset', 'step', 'stop', 'seek' (go to the latest checkpoint at or before `until`) or 'play' (real-time
+    playback, server pushes steps until 'stop' or `until`, 0 plays forever)"""
     until = fields.Int()
     dt = fields.Float(default=0.001)
     sample_every = fields.Int(required=True)
+    encoding = fields.Str(default='binary')
+    """Encoding of SimulationSteps answer: 'binary' (see nengo_3d_frames) or 'json' (for debugging)"""
     observe = fields.List(fields.Nested(Observe))
     plot_lines = fields.List(fields.Nested(PlotLines))
+    rate = fields.Float(default=1.0)
+    """'play': simulated seconds per wall clock second"""
+    fps = fields.Float(default=24.0)
+    """'play': steps are pushed this many times per second"""
+    simulator = fields.Nested(SimulatorOptions, allow_none=True, default=None)
+    """'reset': options of next built simulator, the simulator is rebuilt when they change"""
+
+
+class SimulationStopped(Schema):
+    """Answer to 'stop' and 'seek' Simulation requests. Steps requested before and not computed yet are discarded.
+
+    After 'seek' simulation continues from `step` (restored from checkpoint), steps after it are computed again.
+    """
+    step = fields.Int(required=True)
+    """Number of computed steps, all of them were sent before this message"""
+    error = fields.Str(allow_none=True, default=None)
+    """Simulation of request `request_id` failed, it is not answered by more steps. Later requests are kept"""
+
+
+class BuildTime(Schema):
+    name = fields.Str(required=True)
+    type = fields.Str(required=True)
+    """'Ensemble' or 'Connection'"""
+    time = fields.Float(required=True)
+    """Seconds, time of connection includes solving decoders"""
+    cached = fields.Bool(allow_none=True, default=None)
+    """Decoders were loaded from decoder cache, None for connections without decoders"""
+
+
+class BuildReport(Schema):
+    """Sent by server after simulator is built"""
+    time = fields.Float(required=True)
+    """Seconds, whole build including optimizer"""
+    decoder_cache_dir = fields.Str(allow_none=True, default=None)
+    decoder_cache_size = fields.Int(default=0)
+    """Bytes"""
+    objects = fields.List(fields.Nested(BuildTime))
+    """Sorted from the slowest"""
+
+
+class Sweep(Schema):
+    """Simulate every sweep parameter of server (e.g. seeds) in worker processes. Answered by SweepRun messages and
+    SimulationSteps blocks with `run` set"""
+    request_id = fields.Int(allow_none=True, default=None)
+    action = fields.Str(default='start')
+    """'start' or 'stop'"""
+    until = fields.Int()
+    dt = fields.Float(default=0.001)
+    sample_every = fields.Int(default=1)
+    observe = fields.List(fields.Nested(Observe))
+
+
+class SweepRun(Schema):
+    """State of one run of sweep"""
+    run = fields.Int(required=True)
+    parameter = fields.Str(required=True)
+    """repr of parameter passed to model factory"""
+    state = fields.Str(required=True)
+    """'queued', 'running', 'finished', 'failed' or 'cancelled'"""
+    step = fields.Int(default=0)
+    """Number of simulated steps, set when run ended"""
+    error = fields.Str(allow_none=True, default=None)
 
 
 class ConnectionSchema(Schema):
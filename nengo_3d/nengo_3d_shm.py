@@ -0,0 +1,101 @@
+"""Shared memory transport shared by nengo_3d server and bl_nengo_3d addon.
+
+When Blender runs on the same machine as the server, binary messages (see `nengo_3d_frames`) are written to a ring
+buffer in shared memory and socket carries only `nengo_3d_schemas.SharedMemoryBlock` notifications.
+
+Memory layout:
+
+    RING_HEADER (capacity, written bytes, released bytes) | ring of `capacity` bytes
+
+Server is the only writer of messages, client is the only writer of released bytes. Positions are monotonic byte
+counters, offset in the ring is ``position % capacity``. Message is never split on the ring boundary.
+"""
+import logging
+import struct
+from multiprocessing import shared_memory
+from typing import Iterable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+RING_HEADER = struct.Struct('<QQQ')
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class SharedMemoryRing:
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self._shm = shm
+        self.owner = owner
+        self.capacity, _, _ = RING_HEADER.unpack_from(self._shm.buf, 0)
+
+    @classmethod
+    def create(cls, capacity: int) -> 'SharedMemoryRing':
+        shm = shared_memory.SharedMemory(create=True, size=RING_HEADER.size + capacity)
+        RING_HEADER.pack_into(shm.buf, 0, capacity, 0, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'SharedMemoryRing':
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            # attaching process must not remove memory owned by server when it exits (posix only)
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        return cls(shm, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def written(self) -> int:
+        return RING_HEADER.unpack_from(self._shm.buf, 0)[1]
+
+    @property
+    def released(self) -> int:
+        return RING_HEADER.unpack_from(self._shm.buf, 0)[2]
+
+    def write(self, parts: Iterable[Buffer]) -> Optional[tuple[int, int]]:
+        """Copy message parts to the ring.
+
+        Returns (position, size) to send to the reader, or None when there is not enough free space
+        (reader is too slow or message is bigger than the ring). Then the message must be sent differently.
+        """
+        parts = [memoryview(part).cast('B') for part in parts]
+        size = sum(part.nbytes for part in parts)
+        position = written = self.written
+        released = self.released
+        offset = position % self.capacity
+        if offset + size > self.capacity:
+            position += self.capacity - offset  # skip to the start of the ring
+            offset = 0
+        if released >= written:
+            released = position  # ring is empty
+        if position + size - released > self.capacity:
+            return None
+        start = RING_HEADER.size + offset
+        for part in parts:
+            self._shm.buf[start:start + part.nbytes] = part
+            start += part.nbytes
+        struct.pack_into('<Q', self._shm.buf, 8, position + size)
+        return position, size
+
+    def read(self, position: int, size: int) -> memoryview:
+        """View on message written at position. Valid until `release`"""
+        start = RING_HEADER.size + position % self.capacity
+        return self._shm.buf[start:start + size]
+
+    def release(self, position: int, size: int) -> None:
+        """Allow writer to reuse memory of message and all messages before it"""
+        struct.pack_into('<Q', self._shm.buf, 16, position + size)
+
+    def close(self) -> None:
+        try:
+            self._shm.close()
+        except BufferError as e:  # some view is still alive
+            logger.warning(f'Shared memory {self.name} was not closed: {e}')
+            return
+        if self.owner:
+            self._shm.unlink()
@@ -1,3 +1,4 @@
+import itertools
 import logging
 import math
 from collections import Sequence
@@ -510,6 +511,19 @@ class Axes(AxesAccessors):
             obj.location.z = value * i
         self._nengo_axes.line_offset = value
 
+    def add_line(self, line_prop: 'LineProperties') -> Line:
+        """Create line for property added after axes were created"""
+        i = len(self._lines)
+        color_gen_prop = self._nengo_axes.color_gen
+        color_gen_prop.max_colors = max(color_gen_prop.max_colors, i + 1)
+        color_gen = colors.cycle_color(color_gen_prop.initial_color, color_gen_prop.shift, color_gen_prop.max_colors)
+        line = Line(self, line=line_prop)
+        obj = bpy.data.objects[line.line_name]
+        obj.location.z = self.line_offset * i
+        obj.nengo_attributes.color = next(itertools.islice(color_gen, i, None))
+        self._lines[line_prop.name] = line
+        return line
+
     def get_line(self, line_prop: 'LineProperties') -> Line:
         # logger.debug(self._lines)
         return self._lines[line_prop.name]
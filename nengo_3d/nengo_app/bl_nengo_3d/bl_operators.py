@@ -1,4 +1,5 @@
 import logging
+import math
 import os.path
 import socket
 import time
@@ -7,6 +8,7 @@ from functools import partial
 
 import bpy
 
+import nengo_3d_frames
 import bl_nengo_3d.schemas as schemas
 from bl_nengo_3d import colors
 from bl_nengo_3d.bl_depsgraph_handler import graph_edges_recalculate_handler
@@ -16,7 +18,7 @@ from bl_nengo_3d.bl_properties import Nengo3dProperties, node_color_single_updat
     node_attribute_with_types_update, Nengo3dShowNetwork, ColorGeneratorProperties, edge_color_single_update, \
     edge_attribute_with_types_update, regenerate_network
 from bl_nengo_3d.axes import Axes
-from bl_nengo_3d.connection_handler import handle_data, handle_network_model
+from bl_nengo_3d.connection_handler import handle_data, handle_network_model, Receiver
 from bl_nengo_3d.share_data import share_data
 
 message = schemas.Message()
@@ -122,9 +124,26 @@ class ConnectOperator(bpy.types.Operator):
         except Exception as e:
             self.report({'ERROR'}, f'Nengo 3d connection failed: {e}')
             return {'CANCELLED'}
-        client.setblocking(False)
-        client.settimeout(0.01)
+        client.setblocking(False)  # handle_data must never block the UI, it has time budget
         share_data.client = client
+        share_data.receiver = Receiver(client)
+        share_data.receiver.start()
+        nengo_3d = context.scene.nengo_3d
+        mess = message.dumps({'schema': schemas.Handshake.__name__,
+                              'data': schemas.Handshake().dump({
+                                  'compression': nengo_3d.compression,
+                                  'compression_level': nengo_3d.compression_level,
+                                  'compression_threshold': nengo_3d.compression_threshold,
+                                  'shared_memory': nengo_3d.use_shared_memory,
+                                  'shared_memory_size': nengo_3d.shared_memory_size * 1024 * 1024,
+                                  'credit_frames': nengo_3d.credit_frames if nengo_3d.use_flow_control else 0,
+                                  'credit_bytes': nengo_3d.credit_size * 1024 * 1024,
+                                  'chunk_steps': nengo_3d.chunk_steps,
+                                  'chunk_time': nengo_3d.chunk_time,
+                                  'lookahead_steps': nengo_3d.lookahead_steps,
+                                  'lookahead_bytes': nengo_3d.lookahead_size * 1024 * 1024})})
+        logging.debug(f'Sending: {mess}')
+        share_data.sendall(mess.encode('utf-8'))
         mess = message.dumps({'schema': schemas.NetworkSchema.__name__})
 
         logging.debug(f'Sending: {mess}')
@@ -155,16 +174,23 @@ class DisconnectOperator(bpy.types.Operator):
     def execute(self, context):
         bpy.app.handlers.frame_change_pre.remove(frame_change_handler)
         bpy.app.handlers.depsgraph_update_post.remove(graph_edges_recalculate_handler)
+        share_data.stop_receiver()
         share_data.client.shutdown(socket.SHUT_RDWR)
         share_data.client.close()
         share_data.client = None
+        share_data.compression = nengo_3d_frames.Compression()
+        share_data.close_shared_memory()
+        share_data.subscriber = False
         context.scene.frame_current = 0
         share_data.step_when_ready = 0
         share_data.requested_steps_until = -1
+        share_data.pending_requests.clear()
         share_data.current_step = -1
         share_data.resume_playback_on_steps = False
         # share_data.simulation_cache_step.clear()
         share_data.simulation_cache.clear()
+        share_data.sweep_runs.clear()
+        share_data.sweep_cache.clear()
         self.report({'INFO'}, 'Disconnected')
         return {'FINISHED'}
 
@@ -217,6 +243,8 @@ class NengoSimulateOperator(bpy.types.Operator):
             ('step', 'step', ''),
             ('reset', 'reset', ''),
             ('continuous', 'continuous', ''),
+            ('stop', 'stop', 'Cancel requested steps that are not computed yet'),
+            ('live', 'live', 'Real-time playback, server simulates at given rate and pushes steps'),
         ], name='Action')
 
     _timer = None
@@ -233,6 +261,10 @@ class NengoSimulateOperator(bpy.types.Operator):
         if self.action == 'reset':
             self.action_reset(context.scene)
             return {'FINISHED'}
+        elif self.action == 'stop':
+            context.scene.is_simulation_playing = False
+            self.action_stop(context.scene)
+            return {'FINISHED'}
         elif self.action == 'step':
             observe, plot = share_data.get_all_sources(context.scene.nengo_3d)
             if len(observe) == 0 and len(plot) == 0:
@@ -241,6 +273,21 @@ class NengoSimulateOperator(bpy.types.Operator):
             self.simulation_step(context.scene, action='step', step_num=nengo_3d.step_n,
                                  sample_every=nengo_3d.sample_every, dt=nengo_3d.dt, prefetch=0)
             return {'FINISHED'}
+        elif self.action == 'live':
+            if share_data.live_request is not None:
+                self.action_stop(context.scene)
+                share_data.live_request = None
+                return {'FINISHED'}
+            observe, plot = share_data.get_all_sources(context.scene.nengo_3d)
+            if len(observe) == 0 and len(plot) == 0:
+                self.report({'ERROR'}, 'There is nothing to observe. Make a plot first')
+                return {'CANCELLED'}
+            context.scene.is_simulation_playing = False
+            self.action_stop(context.scene)
+            share_data.live_request = self.send_simulation(context.scene, action='play', until=0,
+                                                           sample_every=nengo_3d.sample_every, dt=nengo_3d.dt,
+                                                           rate=nengo_3d.live_rate, fps=nengo_3d.live_fps)
+            return {'FINISHED'}
         elif self.action == 'continuous':
             observe, plot = share_data.get_all_sources(context.scene.nengo_3d)
             if len(observe) == 0 and len(plot) == 0:
@@ -263,37 +310,42 @@ class NengoSimulateOperator(bpy.types.Operator):
     def action_reset(scene: bpy.types.Scene):
         nengo_3d = scene.nengo_3d
         nengo_3d.requires_reset = False
-        scene.frame_current = 0
+        resume_step = scene.frame_current if nengo_3d.resume_on_reset else 0
+        scene.frame_current = resume_step
         share_data.step_when_ready = 0
         share_data.requested_steps_until = -1
+        share_data.pending_requests.clear()  # answers to old requests will be dropped
+        share_data.live_request = None
         share_data.current_step = -1
         share_data.resume_playback_on_steps = False
         # share_data.simulation_cache_step.clear()
         share_data.simulation_cache.clear()
         observe, plot = share_data.get_all_sources(nengo_3d)
-        NengoSimulateOperator.simulation_step(scene, action='reset', step_num=0,
-                                              sample_every=nengo_3d.sample_every,
-                                              dt=nengo_3d.dt, prefetch=0, observe=observe, plot=plot)
+        simulator = {'dtype': nengo_3d.simulator_dtype,
+                     'optimize': nengo_3d.simulator_optimize,
+                     'progress_bar': nengo_3d.simulator_progress_bar,
+                     'seed': nengo_3d.simulator_seed if nengo_3d.use_simulator_seed else None}
+        NengoSimulateOperator.send_simulation(scene, action='reset', until=0, sample_every=nengo_3d.sample_every,
+                                              dt=nengo_3d.dt, observe=observe, plot=plot, track=False,
+                                              simulator=simulator)
+        if resume_step:
+            # server continues from the nearest checkpoint, earlier steps of new observations are not available
+            NengoSimulateOperator.send_simulation(scene, action='seek', until=resume_step,
+                                                  sample_every=nengo_3d.sample_every, dt=nengo_3d.dt, track=False)
 
     @staticmethod
-    def simulation_step(scene, action: str, step_num: int, sample_every: int, dt: float,
-                        prefetch: int = 0, observe: list = None, plot: list = None):
-        observe = observe or []
-        plot = plot or []
-        observables = []
-        plotable = []
-        for i in observe:
-            observables.append({'source': i[0],
-                                'access_path': i[1],
-                                'sample_every': sample_every,
-                                'dt': dt})
-        for i in plot:
-            plotable.append({
-                'source': i[0],
-                'access_path': i[1],
-                'step': i[2],
-            })
+    def action_stop(scene: bpy.types.Scene):
+        """Ask server to discard requested steps that are not computed yet. Computed steps are still received"""
+        if not share_data.pending_requests:
+            return
+        nengo_3d = scene.nengo_3d
+        NengoSimulateOperator.send_simulation(scene, action='stop', until=0, sample_every=nengo_3d.sample_every,
+                                              dt=nengo_3d.dt, track=False)
+        share_data.step_when_ready = 0
 
+    @staticmethod
+    def simulation_step(scene, action: str, step_num: int, sample_every: int, dt: float,
+                        prefetch: int = 0, observe: dict = None, plot: set = None):
         cached_steps = share_data.current_step
         if cached_steps and scene.frame_current + step_num < cached_steps * sample_every:
             # everything is cached, just go to required frame
@@ -311,35 +363,77 @@ class NengoSimulateOperator(bpy.types.Operator):
                 # do not send request is already waiting for steps
                 # logging.debug(f'Not requesting: {share_data.requested_steps_until} >= {num_steps_to_request}')
                 return
-            data = {'action': action,
-                    'until': num_steps_to_request,
-                    'dt': dt,
-                    'sample_every': sample_every,
-                    'observe': observables,
-                    'plot_lines': plotable}
-            mess = message.dumps({'schema': schemas.Simulation.__name__,
-                                  'data': simulation_scheme.dump(data)
-                                  })
-            share_data.sendall(mess.encode('utf-8'))
-            share_data.requested_steps_until = num_steps_to_request
+            NengoSimulateOperator.send_simulation(scene, action=action, until=num_steps_to_request,
+                                                  sample_every=sample_every, dt=dt, observe=observe, plot=plot)
             share_data.step_when_ready = num_steps_to_request  # step_num * sample_every
 
+    @staticmethod
+    def send_simulation(scene, action: str, until: int, sample_every: int, dt: float,
+                        observe: dict = None, plot: set = None, track: bool = True, **options) -> int:
+        """Send Simulation request, it is tracked in share_data.pending_requests until server answers it.
+
+        Options are other fields of Simulation schema, e.g. rate of 'play'"""
+        if share_data.subscriber:
+            return share_data.new_request()  # server ignores it, do not wait for answer
+        observe = observe or {}
+        plot = plot or []
+        observables = []
+        plotable = []
+        for (source, access_path), precision in observe.items():
+            observables.append({'source': source,
+                                'access_path': access_path,
+                                'sample_every': sample_every,
+                                'dt': dt,
+                                'precision': precision,
+                                'top_k': share_data.observe_top_k.get((source, access_path), 0)})
+        for i in plot:
+            plotable.append({
+                'source': i[0],
+                'access_path': i[1],
+                'step': i[2],
+            })
+        request_id = share_data.new_request(until=until if track else None)
+        data = {'request_id': request_id,
+                'action': action,
+                'until': until,
+                'dt': dt,
+                'sample_every': sample_every,
+                'encoding': scene.nengo_3d.message_encoding,
+                'observe': observables,
+                'plot_lines': plotable,
+                **options}
+        mess = message.dumps({'schema': schemas.Simulation.__name__,
+                              'data': simulation_scheme.dump(data)
+                              })
+        share_data.sendall(mess.encode('utf-8'))
+        return request_id
+
+    @staticmethod
+    def prefetch(scene, window: int, windows: int):
+        """Keep up to `windows` step requests, `window` steps each, in flight ahead of current frame"""
+        nengo_3d = scene.nengo_3d
+        window = math.ceil(window / nengo_3d.sample_every) * nengo_3d.sample_every  # server rounds down
+        until = max(share_data.requested_steps_until, scene.frame_current)
+        while len(share_data.pending_requests) < windows and until < scene.frame_current + windows * window:
+            until += window
+            NengoSimulateOperator.send_simulation(scene, action='step', until=until,
+                                                  sample_every=nengo_3d.sample_every, dt=nengo_3d.dt)
+
     def modal(self, context, event):
         if not context.scene.is_simulation_playing or event.type in {'RIGHTMOUSE', 'ESC'}:
             self.cancel(context)
             return {'CANCELLED'}
 
         if event.type == 'TIMER':
-            nengo_3d = context.scene.nengo_3d
+            scene = context.scene
+            nengo_3d = scene.nengo_3d
             speed = nengo_3d.speed
-            if share_data.current_step >= context.scene.frame_current:
-                frame_change_time = execution_times.average()
-                dropped_frames = frame_change_time * 24
-                self.simulation_step(context.scene, action='step', step_num=int((1 + dropped_frames) * speed),
-                                     sample_every=nengo_3d.sample_every, dt=nengo_3d.dt, prefetch=min(24 * speed, 24))
-            elif share_data.requested_steps_until <= context.scene.frame_current:
-                self.simulation_step(context.scene, action='step', step_num=0, sample_every=nengo_3d.sample_every,
-                                     dt=nengo_3d.dt, prefetch=min(24 * speed, 24))
+            frame_change_time = execution_times.average()
+            dropped_frames = frame_change_time * 24
+            step_num = max(int((1 + dropped_frames) * speed), 1)
+            if scene.frame_current + step_num <= share_data.current_step * nengo_3d.sample_every:
+                scene.frame_current += step_num
+            self.prefetch(scene, window=max(int(24 * speed), 1), windows=nengo_3d.prefetch_windows)
         return {'PASS_THROUGH'}
 
     def cancel(self, context):
@@ -347,6 +441,41 @@ class NengoSimulateOperator(bpy.types.Operator):
         wm.event_timer_remove(self._timer)
         context.scene.is_simulation_playing = False
         self._timer = None
+        self.action_stop(context.scene)
+
+
+class NengoSweepOperator(bpy.types.Operator):
+    """Simulate every sweep parameter of server (e.g. seeds) side by side. Lines show selected run"""
+    bl_idname = 'nengo_3d.sweep'
+    bl_label = 'Sweep'
+
+    action: bpy.props.EnumProperty(
+        items=[
+            ('start', 'start', 'Start all runs, previous sweep is discarded'),
+            ('stop', 'stop', 'Cancel runs that are not finished'),
+        ], name='Action')
+
+    @classmethod
+    def poll(cls, context):
+        return share_data.client is not None
+
+    def execute(self, context):
+        nengo_3d: Nengo3dProperties = context.scene.nengo_3d
+        data = {'request_id': share_data.new_request(), 'action': self.action}
+        if self.action == 'start':
+            observe, _ = share_data.get_all_sources(nengo_3d)
+            if len(observe) == 0:
+                self.report({'ERROR'}, 'There is nothing to observe. Make a plot first')
+                return {'CANCELLED'}
+            share_data.sweep_runs.clear()
+            share_data.sweep_cache.clear()
+            data.update(until=nengo_3d.sweep_steps, dt=nengo_3d.dt, sample_every=nengo_3d.sample_every,
+                        observe=[{'source': source, 'access_path': access_path, 'sample_every': nengo_3d.sample_every,
+                                  'dt': nengo_3d.dt, 'precision': precision}
+                                 for (source, access_path), precision in observe.items()])
+        mess = message.dumps({'schema': schemas.Sweep.__name__, 'data': schemas.Sweep().dump(data)})
+        share_data.sendall(mess.encode('utf-8'))
+        return {'FINISHED'}
 
 
 class NengoColorNodesOperator(bpy.types.Operator):
@@ -446,6 +575,7 @@ classes = (
     DisconnectOperator,
     NengoGraphOperator,
     NengoSimulateOperator,
+    NengoSweepOperator,
     ObjectNames,
     SelectByEdgeOperator,
     SimpleSelectOperator,
@@ -470,8 +600,10 @@ def unregister():
     if share_data.handle_data and bpy.app.timers.is_registered(share_data.handle_data):
         bpy.app.timers.unregister(share_data.handle_data)
         share_data.handle_data = None
+    share_data.stop_receiver()
     if share_data.client:
         share_data.client.shutdown(socket.SHUT_RDWR)
         share_data.client.close()
         share_data.client = None
+    share_data.close_shared_memory()
     unregister_factory()
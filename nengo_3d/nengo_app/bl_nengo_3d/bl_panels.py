@@ -44,10 +44,37 @@ class NengoSettingsPanel(bpy.types.Panel):
             row = layout.row()
             row.scale_y = 1.5
             row.operator(bl_operators.ConnectOperator.bl_idname, text='Connect')
+            row = layout.row(align=True)
+            row.prop(context.scene.nengo_3d, 'compression', text='')
+            subrow = row.row(align=True)
+            subrow.active = context.scene.nengo_3d.compression != 'none'
+            subrow.prop(context.scene.nengo_3d, 'compression_level')
+            subrow.prop(context.scene.nengo_3d, 'compression_threshold')
+            row = layout.row(align=True)
+            row.prop(context.scene.nengo_3d, 'use_shared_memory')
+            subrow = row.row(align=True)
+            subrow.active = context.scene.nengo_3d.use_shared_memory
+            subrow.prop(context.scene.nengo_3d, 'shared_memory_size')
+            row = layout.row(align=True)
+            row.prop(context.scene.nengo_3d, 'use_flow_control')
+            subrow = row.row(align=True)
+            subrow.active = context.scene.nengo_3d.use_flow_control
+            subrow.prop(context.scene.nengo_3d, 'credit_frames')
+            subrow.prop(context.scene.nengo_3d, 'credit_size')
+            row = layout.row(align=True)
+            row.prop(context.scene.nengo_3d, 'chunk_steps')
+            row.prop(context.scene.nengo_3d, 'chunk_time')
+            row = layout.row(align=True)
+            row.prop(context.scene.nengo_3d, 'lookahead_steps')
+            subrow = row.row(align=True)
+            subrow.active = context.scene.nengo_3d.lookahead_steps > 0
+            subrow.prop(context.scene.nengo_3d, 'lookahead_size')
         else:
             row = layout.row()
             row.scale_y = 1.5
             row.operator(bl_operators.DisconnectOperator.bl_idname, text='Disconnect')
+            if share_data.subscriber:
+                layout.label(text='Showing simulation of other client', icon='LINKED')
 
         layout.operator(bl_operators.NengoQuickSaveOperator.bl_idname,
                         text='Quick save!' if bpy.data.is_dirty else 'Quick save')
@@ -73,6 +100,9 @@ class NengoSettingsPanel(bpy.types.Panel):
                         icon='FRAME_NEXT').action = 'step'
         subrow = row.row(align=True)
         subrow.prop(nengo_3d, 'step_n', text='')
+        subrow = row.row(align=True)
+        subrow.active = bool(share_data.pending_requests)
+        subrow.operator(bl_operators.NengoSimulateOperator.bl_idname, text='', icon='X').action = 'stop'
 
         row = col.row(align=True)
         row.active = is_connected
@@ -85,6 +115,19 @@ class NengoSettingsPanel(bpy.types.Panel):
                             icon='PLAY').action = 'continuous'
         subrow = row.row(align=True)
         subrow.prop(nengo_3d, 'speed', text='')
+        subrow.prop(nengo_3d, 'prefetch_windows')
+
+        row = col.row(align=True)
+        subrow = row.row(align=True)
+        if share_data.live_request is not None:
+            subrow.operator(bl_operators.NengoSimulateOperator.bl_idname, text='Stop live',
+                            icon='PAUSE').action = 'live'
+        else:
+            subrow.operator(bl_operators.NengoSimulateOperator.bl_idname, text='Live',
+                            icon='PLAY').action = 'live'
+        subrow = row.row(align=True)
+        subrow.prop(nengo_3d, 'live_rate')
+        subrow.prop(nengo_3d, 'live_fps')
 
         col.prop(context.scene, 'frame_current', text='Current step')
 
@@ -92,6 +135,7 @@ class NengoSettingsPanel(bpy.types.Panel):
         super_col = layout.column()
         super_col.active = is_connected
         super_col.prop(nengo_3d, 'allow_scrubbing')
+        super_col.prop(nengo_3d, 'resume_on_reset')
         super_col.label(text=f'Switching frame took: {frame_change_handler.execution_times.average():.2f} sec')
         row = super_col.row(align=True)
         row.active = is_connected
@@ -105,6 +149,77 @@ class NengoSettingsPanel(bpy.types.Panel):
         super_col.prop(nengo_3d, 'force_one_connection_per_edge')
 
 
+class NengoSweepPanel(bpy.types.Panel):
+    bl_label = 'Sweep'
+    bl_idname = 'NENGO_PT_sweep'
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = 'Nengo 3d'
+    bl_options = {'DEFAULT_CLOSED'}
+    bl_parent_id = NengoSettingsPanel.bl_idname
+
+    def draw(self, context: bpy.types.Context):
+        layout = self.layout
+        layout.active = connected()
+        nengo_3d: Nengo3dProperties = context.scene.nengo_3d
+        row = layout.row(align=True)
+        row.prop(nengo_3d, 'sweep_steps', text='Steps')
+        row.operator(bl_operators.NengoSweepOperator.bl_idname, text='Run', icon='PLAY').action = 'start'
+        row.operator(bl_operators.NengoSweepOperator.bl_idname, text='', icon='X').action = 'stop'
+        if not share_data.sweep_runs:
+            layout.label(text='Lines show selected run (see line source)')
+            return
+        col = layout.box().column(align=True)
+        for run_id, run in sorted(share_data.sweep_runs.items()):
+            cache = share_data.sweep_cache.get(run_id)
+            steps = max((len(i) for i in cache.values()), default=0) if cache else 0
+            row = col.row(align=True)
+            row.label(text=f'{run_id}: {run["parameter"]}')
+            row.label(text=f'{run["state"]}, {steps} steps', icon='ERROR' if run['state'] == 'failed' else 'NONE')
+
+
+class NengoBuildPanel(bpy.types.Panel):
+    bl_label = 'Build'
+    bl_idname = 'NENGO_PT_build'
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = 'Nengo 3d'
+    bl_options = {'DEFAULT_CLOSED'}
+    bl_parent_id = NengoSettingsPanel.bl_idname
+
+    def draw(self, context: bpy.types.Context):
+        layout = self.layout
+        nengo_3d = context.scene.nengo_3d
+        col = layout.column(align=True)
+        col.prop(nengo_3d, 'simulator_dtype')
+        row = col.row(align=True)
+        row.prop(nengo_3d, 'simulator_optimize')
+        row.prop(nengo_3d, 'simulator_progress_bar')
+        row = col.row(align=True)
+        row.prop(nengo_3d, 'use_simulator_seed')
+        subrow = row.row(align=True)
+        subrow.active = nengo_3d.use_simulator_seed
+        subrow.prop(nengo_3d, 'simulator_seed', text='')
+        report = share_data.build_report
+        if not report:
+            layout.label(text='Simulator is not built yet')
+            return
+        solved = sum(1 for obj in report['objects'] if obj['cached'] is False)
+        cached = sum(1 for obj in report['objects'] if obj['cached'])
+        col = layout.column(align=True)
+        col.label(text=f'Built in {report["time"]:.2f} sec')
+        col.label(text=f'Decoders: {solved} solved, {cached} from cache')
+        if report['decoder_cache_dir']:
+            col.label(text=f'Cache: {report["decoder_cache_size"] / 1024 / 1024:.1f}Mb')
+            col.label(text=report['decoder_cache_dir'])
+        box = layout.box()
+        col = box.column(align=True)
+        for obj in report['objects'][:10]:
+            row = col.row(align=True)
+            row.label(text=obj['name'], icon='LINKED' if obj['cached'] else 'NONE')
+            row.label(text=f'{obj["time"]:.3f} sec')
+
+
 class NengoSubnetworksPanel(bpy.types.Panel):
     bl_label = 'Subnetworks'
     bl_idname = 'NENGO_PT_subnetworks'
@@ -240,12 +355,14 @@ class NengoContextPanel(bpy.types.Panel):
         box = layout.box()
         col = box.column(align=True)
         if node['has_vocabulary']:
+            col.prop(bpy.context.scene.nengo_3d, 'similarity_top_k')
             op = col.operator(bl_plot_operators.PlotByRowSimilarityOperator.bl_idname,
                               text=f'Similarity (dim {node["vocabulary_size"]})',
                               icon='ORIENTATION_VIEW')
             op.object = obj_name
             op.access_path = 'probeable.output.similarity'
             op.dimensions = node['vocabulary_size']
+            op.top_k = bpy.context.scene.nengo_3d.similarity_top_k
             op.axes: AxesProperties
             op.axes.xlabel = 'Step'
             op.axes.ylabel = 'Similarity'
@@ -489,6 +606,7 @@ class NengoContextPanel(bpy.types.Panel):
             op.object = obj_name
             op.access_path = 'probeable.output.similarity'
             op.dimensions = node['vocabulary_size']
+            op.top_k = bpy.context.scene.nengo_3d.similarity_top_k
             op.axes: AxesProperties
             op.axes.xlabel = 'Step'
             op.axes.ylabel = 'Similarity'
@@ -507,6 +625,7 @@ class NengoContextPanel(bpy.types.Panel):
             op.object = obj_name
             op.access_path = 'probeable.output.similarity'
             op.dimensions = node['vocabulary_size']
+            op.top_k = bpy.context.scene.nengo_3d.similarity_top_k
             op.axes: AxesProperties
             op.axes.xlabel = 'Step'
             op.axes.ylabel = 'Similarity'
@@ -787,6 +906,7 @@ class NengoNodeColorsPanel(bpy.types.Panel):
             return
         layout.label(text='data: np.array = data[node, access_path][step]')
         layout.prop(nengo_3d, 'node_dynamic_get', text='Get')
+        layout.prop(nengo_3d, 'node_dynamic_precision')
         layout.prop(nengo_3d, 'node_color_map', expand=True)
         if nengo_3d.node_color_map == 'GRADIENT':
             draw_node_gradient(layout, nengo_3d)
@@ -851,6 +971,7 @@ class NengoEdgeColorsPanel(bpy.types.Panel):
             return
         layout.label(text='data: np.array = data[node, access_path][step]')
         layout.prop(nengo_3d, 'edge_dynamic_get', text='Get')
+        layout.prop(nengo_3d, 'edge_dynamic_precision')
         layout.prop(nengo_3d, 'edge_color_map', expand=True)
         if nengo_3d.edge_color_map == 'GRADIENT':
             draw_edge_gradient(layout, nengo_3d, )
@@ -903,6 +1024,8 @@ class NengoStylePanel(bpy.types.Panel):
 
 classes = (
     NengoSettingsPanel,
+    NengoBuildPanel,
+    NengoSweepPanel,
     NengoContextPanel,
     NengoInfoPanel,
     NengoLayoutPanel,
@@ -141,10 +141,16 @@ class PlotByRowSimilarityOperator(PlotLineOperator):
     object: bpy.props.StringProperty(options={'SKIP_SAVE'})
     access_path: bpy.props.StringProperty(options={'SKIP_SAVE'})
     dimensions: bpy.props.IntProperty(options={'SKIP_SAVE'})
+    top_k: bpy.props.IntProperty(options={'SKIP_SAVE'}, description='Add lines lazily for top k keys, 0 for all')
 
     def invoke(self, context, event):
         node = share_data.model_graph.get_node_data(self.object)
         self.axes.model_source = self.object  # workaround for screating plot from edge
+        if self.top_k:
+            # lines are added by add_top_k_lines
+            self.axes.top_k = self.top_k
+            self.axes.top_k_access_path = self.access_path
+            return self.execute(context)
         for i in range(self.dimensions):
             line: LineProperties = self.axes.lines.add()
             line.source: LineSourceProperties
@@ -157,6 +163,31 @@ class PlotByRowSimilarityOperator(PlotLineOperator):
         return self.execute(context)
 
 
+def add_top_k_lines(source: str, access_path: str, keys: list[int]):
+    """Add lines of top k similarity charts for keys that got among top k (see PlotByRowSimilarityOperator)"""
+    node = share_data.model_graph.get_node_data(source) if share_data.model_graph else None
+    vocabulary = node['vocabulary'] if node else []
+    for ax in share_data.charts.get(source, []):
+        ax: Axes
+        nengo_axes: AxesProperties = ax._nengo_axes
+        if not nengo_axes.top_k or nengo_axes.top_k_access_path != access_path:
+            continue
+        existing = {line.source.get_y for line in nengo_axes.lines}
+        for key in keys:
+            get_y = f'row[{key}]'
+            if get_y in existing:
+                continue
+            line: LineProperties = nengo_axes.lines.add()
+            line.source: LineSourceProperties
+            line.source.source_obj = source
+            line.source.access_path = access_path
+            line.source.iterate_step = True
+            line.source.get_x = 'step'
+            line.source.get_y = get_y
+            line.label = vocabulary[key] if key < len(vocabulary) else f'Key {key}'
+            ax.add_line(line)
+
+
 class PlotByRowOperator(PlotLineOperator):
     bl_idname = 'nengo_3d.plot_byrow'
     bl_label = 'Plot output'
@@ -44,6 +44,20 @@ def draw_color_generator_properties_template(layout: bpy.types.UILayout, color_g
 
 
 # step based
+precision_items = [
+    ('float64', 'Float64', 'Exact data'),
+    ('float32', 'Float32', 'Half of the bandwidth, enough for charts'),
+    ('float16', 'Float16', 'Quarter of the bandwidth, enough for colors'),
+    ('uint8', 'Uint8', 'Eighth of the bandwidth, 255 levels between min and max of each message'),
+]
+
+
+def precision_update(self, context):
+    from bl_nengo_3d.share_data import share_data
+    if share_data.model_graph is not None:
+        context.scene.nengo_3d.requires_reset = True
+
+
 class LineSourceProperties(bpy.types.PropertyGroup):
     # .name is line object name
     source_obj: bpy.props.StringProperty(name='Source', description='Source element from model')  # make enum?
@@ -51,6 +65,10 @@ class LineSourceProperties(bpy.types.PropertyGroup):
     # introduce special variables for step, tstep (trange)?
     iterate_step: bpy.props.BoolProperty(name='Iterate last n steps')
     fixed_step: bpy.props.IntProperty()
+    run: bpy.props.IntProperty(name='Run', default=-1, min=-1,
+                               description='Sweep run to plot, -1 plots interactive simulation')
+    precision: bpy.props.EnumProperty(name='Precision', items=precision_items, default='float64',
+                                      update=precision_update, description='Precision of data sent by server')
     # todo validate and report errors:
     get_x: bpy.props.StringProperty(default='')
     get_y: bpy.props.StringProperty(default='')
@@ -61,10 +79,13 @@ def draw_line_source_properties_template(layout: bpy.types.UILayout, line_source
     row = layout.row(align=True)
     row.prop(line_source, 'source_obj')
     row.prop(line_source, 'access_path', text='')
+    layout.prop(line_source, 'run')
     row = layout.row(align=True)
     row.prop(line_source, 'iterate_step')
     if not line_source.iterate_step:
         row.prop(line_source, 'fixed_step')
+    else:
+        row.prop(line_source, 'precision', text='')
     col = layout.column(align=True)
     if line_source.iterate_step:
         col.label(text='for step, row in zip(steps, data):')
@@ -266,6 +287,9 @@ class AxesProperties(bpy.types.PropertyGroup):
     lines_collection_name: bpy.props.StringProperty()
     lines: bpy.props.CollectionProperty(type=LineProperties)
     line_offset: bpy.props.FloatProperty(name='Line offset', update=line_offset_update, step=1)
+    top_k: bpy.props.IntProperty(min=0, description='Chart observes only this many most similar keys per step, '
+                                                    'lines are added when key gets among them')
+    top_k_access_path: bpy.props.StringProperty()
 
     legend_collection_name: bpy.props.StringProperty()
     legend_collection: bpy.props.CollectionProperty(type=LegendProperties)
@@ -875,7 +899,77 @@ class Nengo3dProperties(bpy.types.PropertyGroup):
     dt: bpy.props.FloatProperty(default=0.001, min=0.0, precision=3, step=1, update=sample_every_update)
     step_n: bpy.props.IntProperty(name='Step N', default=100, min=1)
     speed: bpy.props.FloatProperty(default=1.0, min=0.01, description='Default simulation rate is 24 steps per second')
+    prefetch_windows: bpy.props.IntProperty(name='Prefetch', default=2, min=1,
+                                            description='Number of step requests kept in flight during playback')
+    simulator_dtype: bpy.props.EnumProperty(
+        name='Precision', items=[('float64', 'float64', ''),
+                                 ('float32', 'float32', 'Less memory, faster steps of large models')],
+        update=sample_every_update, description='Precision of simulator signals')
+    simulator_optimize: bpy.props.BoolProperty(name='Optimize', default=True, update=sample_every_update,
+                                               description='Merge operators after build: slower build, faster steps')
+    simulator_progress_bar: bpy.props.BoolProperty(name='Progress bar', default=False,
+                                                   description='Show build progress in server console')
+    use_simulator_seed: bpy.props.BoolProperty(name='Seed', default=False, update=sample_every_update,
+                                               description='Build network with given seed (encoders, gains, decoders)')
+    simulator_seed: bpy.props.IntProperty(name='Seed', default=0, min=0, update=sample_every_update)
+    similarity_top_k: bpy.props.IntProperty(
+        name='Top k', default=0, min=0,
+        description='New similarity charts show only keys that get among k most similar at any step. '
+                    'Server sends only k keys per step. 0 shows all keys')
+    live_rate: bpy.props.FloatProperty(name='Rate', default=1.0, min=0.001, precision=3,
+                                       description='Simulated seconds per second of real-time playback')
+    live_fps: bpy.props.FloatProperty(name='FPS', default=24, min=1, max=120, precision=0,
+                                      description='Server pushes steps this many times per second. When simulation '
+                                                  'or viewport can not keep up, older steps are skipped')
+    sweep_steps: bpy.props.IntProperty(name='Sweep steps', default=1000, min=1,
+                                       description='Steps simulated by every run of sweep')
     allow_scrubbing: bpy.props.BoolProperty(name='Step by timeline scrubbing')
+    resume_on_reset: bpy.props.BoolProperty(
+        name='Resume on reset',
+        description='After reset continue simulation from the nearest checkpoint before current step instead of '
+                    'simulating from the start. Earlier steps of new observations are not available')
+    compression: bpy.props.EnumProperty(
+        items=[
+            ('none', 'None', 'Do not compress messages, best for localhost'),
+            ('zlib', 'Zlib', 'Compress big messages with zlib, use on slow network'),
+        ], name='Compression', description='Compression of messages, agreed with server when connecting')
+    compression_level: bpy.props.IntProperty(name='Level', default=6, min=1, max=9,
+                                             description='Zlib compression level, 1 (fast) - 9 (best)')
+    compression_threshold: bpy.props.IntProperty(name='Threshold', default=4096, min=0, subtype='UNSIGNED',
+                                                 description='Messages smaller than threshold (bytes) are not '
+                                                             'compressed')
+    use_shared_memory: bpy.props.BoolProperty(
+        name='Shared memory', default=True,
+        description='Receive simulation steps through shared memory. Works only if server runs on the same machine')
+    shared_memory_size: bpy.props.IntProperty(name='Size (Mb)', default=64, min=1,
+                                              description='Size of shared memory buffer for simulation steps')
+    use_flow_control: bpy.props.BoolProperty(
+        name='Flow control', default=True,
+        description='Server simulates and sends steps only as fast as they are consumed')
+    credit_frames: bpy.props.IntProperty(name='Frames', default=16, min=1,
+                                         description='Maximum number of step messages sent but not yet consumed')
+    credit_size: bpy.props.IntProperty(name='Size (Mb)', default=64, min=1,
+                                       description='Maximum size of step messages sent but not yet consumed')
+    chunk_steps: bpy.props.IntProperty(name='Chunk', default=100, min=0,
+                                       description='Server answers step requests in chunks of this many steps, '
+                                                   '0 answers whole request at once')
+    chunk_time: bpy.props.FloatProperty(name='Chunk (ms)', default=50, min=0, precision=0,
+                                        description='Server sends computed steps at least this often while '
+                                                    'simulating, 0 answers whole request at once')
+    lookahead_steps: bpy.props.IntProperty(name='Lookahead', default=1000, min=0,
+                                           description='Server simulates this many steps ahead of requested steps, '
+                                                       'so playback does not wait for simulation. 0 disables it')
+    lookahead_size: bpy.props.IntProperty(name='Size (Mb)', default=64, min=1,
+                                          description='Memory budget of steps simulated ahead on server')
+    receive_budget: bpy.props.FloatProperty(
+        name='Receive budget (ms)', default=8, min=0.1, precision=1,
+        description='Maximum time spent on handling incoming messages per timer tick. '
+                    'Lower values keep the viewport responsive, higher values drain incoming data faster')
+    message_encoding: bpy.props.EnumProperty(
+        items=[
+            ('binary', 'Binary', 'Receive simulation steps as raw numpy buffers'),
+            ('json', 'JSON', 'Receive simulation steps as json, slow. Use for debugging'),
+        ], name='Encoding', description='Encoding of simulation steps sent by server')
     collection: bpy.props.StringProperty(name='Collection', default='Nengo Model')
     algorithm_dim: bpy.props.EnumProperty(
         items=[
@@ -919,6 +1013,9 @@ class Nengo3dProperties(bpy.types.PropertyGroup):
     node_dynamic_access_path: bpy.props.EnumProperty(name='Dynamic attributes', items=probeable_nodes_items,
                                                      update=node_dynamic_access_path_update)
     node_dynamic_get: bpy.props.StringProperty(default='sum(data)')
+    node_dynamic_precision: bpy.props.EnumProperty(name='Precision', items=precision_items, default='float64',
+                                                  update=precision_update,
+                                                  description='Precision of data sent by server')
     node_attr_auto_range: bpy.props.BoolProperty(name='Auto range', default=True)
     node_attr_min: bpy.props.FloatProperty(name='Min')
     node_attr_max: bpy.props.FloatProperty(name='Max', default=1)
@@ -942,6 +1039,9 @@ class Nengo3dProperties(bpy.types.PropertyGroup):
     edge_dynamic_access_path: bpy.props.EnumProperty(name='Dynamic attributes', items=probeable_edges_items,
                                                      update=edge_dynamic_access_path_update)
     edge_dynamic_get: bpy.props.StringProperty(default='sum(data)')
+    edge_dynamic_precision: bpy.props.EnumProperty(name='Precision', items=precision_items, default='float64',
+                                                  update=precision_update,
+                                                  description='Precision of data sent by server')
     edge_attr_auto_range: bpy.props.BoolProperty(name='Auto range', default=True)
     edge_attr_min: bpy.props.FloatProperty(name='Min')
     edge_attr_max: bpy.props.FloatProperty(name='Max', default=1)
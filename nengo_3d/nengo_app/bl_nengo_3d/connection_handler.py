@@ -1,18 +1,23 @@
 import logging
 import math
 import os
+import queue
+import select
 import socket
-import struct
+import threading
 import time
 from functools import partial
+from typing import Any, NamedTuple, Optional
 
 import bpy
 import networkx as nx
 import numpy as np
 from mathutils import Vector
 
+import nengo_3d_frames
+import nengo_3d_shm
 import bl_nengo_3d.schemas as schemas
-from bl_nengo_3d import nx_layouts, bl_operators
+from bl_nengo_3d import nx_layouts, bl_operators, bl_plot_operators
 from bl_nengo_3d.bl_nengo_primitives import get_primitive_material, get_primitive
 from bl_nengo_3d.bl_properties import Nengo3dProperties
 from bl_nengo_3d.utils import normalize
@@ -22,68 +27,304 @@ from bl_nengo_3d.time_utils import ExecutionTimes
 logger = logging.getLogger(__file__)
 
 update_interval = 0.1
+"""Timer interval when no data is incoming"""
+busy_update_interval = 0.005
+"""Timer interval while data is flowing"""
 
 execution_times = ExecutionTimes(max_items=10)
+"""Time of applying single message"""
+tick_times = ExecutionTimes(max_items=10)
+"""Time spent in one call of handle_data"""
+queue_depth = 0
+"""Decoded messages left waiting after last call of handle_data"""
+_current_interval = update_interval
+
+
+class DecodedMessage(NamedTuple):
+    schema: str
+    data: Any
+    request_id: Optional[int] = None
+    complete: bool = True
+    """False when more answers to the same request will follow"""
+    size: int = 0
+    """Size of message in bytes (after decompression), counted against flow control credit"""
+
+
+def undecoded_steps(size: int) -> DecodedMessage:
+    """SimulationSteps message that could not be decoded. Server counted it against credit, so the credit is returned
+    when it is applied, otherwise the server would run out of credit and stop sending steps"""
+    return DecodedMessage(schemas.Credit.__name__, None, size=size)
+
+
+class Receiver(threading.Thread):
+    """Reads, decompresses and decodes messages from server in background thread.
+
+    Decoded messages are put on bounded `queue` and applied to blender data by `handle_data` timer on main thread.
+    When the queue is full, receiver stops reading socket and server is slowed down by TCP.
+    """
+
+    def __init__(self, client: socket.socket, max_queued: int = 64):
+        super().__init__(name='nengo_3d receiver', daemon=True)
+        self.client = client
+        self.frame_reader = nengo_3d_frames.FrameReader(client)
+        self.queue: queue.Queue[DecodedMessage] = queue.Queue(maxsize=max_queued)
+        self.decode_times = ExecutionTimes(max_items=10)
+        """Time of decoding single message"""
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        try:
+            while not self._stop_event.is_set():
+                frame = self.frame_reader.next_frame()
+                if frame is None:
+                    readable, _, _ = select.select([self.client], [], [], 0.1)
+                    if readable and not self.frame_reader.recv():
+                        logger.warning('Connection closed by server')
+                        break
+                    continue
+                start = time.time()
+                try:
+                    decoded = decode_frame(frame)
+                except Exception as e:
+                    logger.exception(e)
+                    continue
+                self.decode_times.append(time.time() - start)
+                if decoded:
+                    self._put(decoded)
+        except (OSError, ValueError) as e:
+            if not self._stop_event.is_set():  # socket is closed on disconnect
+                logger.exception(e)
+
+    def _put(self, decoded: DecodedMessage) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self.queue.put(decoded, timeout=0.1)
+                return
+            except queue.Full:
+                continue
 
 
 def handle_data(scene: str):
-    # In non-blocking mode blocking operations error out with OS specific errors.
-    # https://docs.python.org/3/library/socket.html#notes-on-socket-timeouts
-    if not share_data.client:
+    """Timer callback, applies decoded messages within time budget (Nengo3dProperties.receive_budget)"""
+    global queue_depth, _current_interval
+    receiver: Receiver = share_data.receiver
+    if not share_data.client or not receiver:
         return None
+    budget = bpy.data.scenes[scene].nengo_3d.receive_budget / 1000
+    tick_start = time.perf_counter()
+    handled = 0
     try:
-        size = struct.unpack("i", share_data.client.recv(struct.calcsize("i")))[0]
-        data = ""
-        while len(data) < size:
-            msg = share_data.client.recv(size - len(data))
-            if not msg:
-                return None
-            data += msg.decode('utf-8')
-    except socket.timeout:
-        return update_interval
-    except (ConnectionAbortedError, ConnectionResetError) as e:
-        logger.exception(e)
+        while time.perf_counter() - tick_start < budget:
+            try:
+                message = receiver.queue.get_nowait()
+            except queue.Empty:
+                break
+            start = time.time()
+            try:
+                apply_message(message, scene)
+            except Exception as e:
+                logger.exception(e)
+            execution_times.append(time.time() - start)
+            handled += 1
+    finally:
+        tick_times.append(time.perf_counter() - tick_start)
+
+    queue_depth = receiver.queue.qsize()
+    if not receiver.is_alive() and queue_depth == 0:
+        logger.warning('Receiver stopped')
+        return None  # unregisters handler
+    if handled or queue_depth:
+        _current_interval = busy_update_interval
+    else:
+        # back off slowly when idle
+        _current_interval = min(_current_interval * 2, update_interval)
+    return _current_interval
+
+
+def decode_frame(data: memoryview) -> Optional[DecodedMessage]:
+    """Runs in `Receiver` thread, must not touch blender data. Data is a view on reader buffer, valid until next recv"""
+    if nengo_3d_frames.is_binary(data):
+        logger.debug(f'Incoming binary: {len(data)} bytes')
+        return decode_binary(data)
+    message = str(data, 'utf-8')
+    logger.debug(f'Incoming: {message[:1000]}')
+    incoming_answer: dict = schemas.Message().loads(message)
+    schema = incoming_answer['schema']
+    if schema == schemas.Handshake.__name__:
+        handle_handshake(incoming_answer)
         return None
+    elif schema == schemas.SharedMemoryBlock.__name__:
+        return decode_shared_memory_block(incoming_answer)
+    elif schema == schemas.NetworkSchema.__name__:
+        return DecodedMessage(schema, schemas.NetworkSchema().load(data=incoming_answer['data']))
+    elif schema == schemas.SimulationSteps.__name__:
+        try:
+            blocks = schemas.SimulationSteps(many=True).load(data=incoming_answer['data'])
+            for block in blocks:
+                block['value'] = nengo_3d_frames.dequantize(np.array(block.pop('data')), block)
+            blocks = expand_top_k_blocks(blocks)
+        except Exception as e:
+            logger.exception(e)
+            return undecoded_steps(len(data))
+        return DecodedMessage(schema, blocks, incoming_answer.get('request_id'), incoming_answer.get('complete', True),
+                              len(data))
+    elif schema == schemas.SimulationStopped.__name__:
+        return DecodedMessage(schema, schemas.SimulationStopped().load(data=incoming_answer['data']),
+                              incoming_answer.get('request_id'))
+    elif schema == schemas.SweepRun.__name__:
+        return DecodedMessage(schema, schemas.SweepRun().load(data=incoming_answer['data']),
+                              incoming_answer.get('request_id'))
+    elif schema == schemas.BuildReport.__name__:
+        return DecodedMessage(schema, schemas.BuildReport().load(data=incoming_answer['data']))
+    elif schema == schemas.PlotLines.__name__:
+        data = schemas.PlotLines().load(data=incoming_answer['data'])
+        data['data'] = np.array(data['data'])
+        return DecodedMessage(schema, data)
+    logger.error(f'Unknown schema: {schema}')
+    return None
+
+
+def decode_binary(message: memoryview) -> Optional[DecodedMessage]:
+    """Server sends only SimulationSteps as binary message, it is counted against credit also when it is broken"""
+    try:
+        incoming_answer = nengo_3d_frames.loads_arrays(message)
+        if incoming_answer['schema'] != schemas.SimulationSteps.__name__:
+            logger.error(f'Unknown binary schema: {incoming_answer["schema"]}')
+            return undecoded_steps(len(message))
+        blocks = incoming_answer['arrays']
+        for block in blocks:
+            # always a copy, message buffer will be reused
+            block['value'] = nengo_3d_frames.dequantize(block['value'], block)
+        blocks = expand_top_k_blocks(blocks)
     except Exception as e:
         logger.exception(e)
-        return None  # unregisters handler
+        return undecoded_steps(len(message))
+    data = incoming_answer['data'] or {}
+    return DecodedMessage(incoming_answer['schema'], blocks, data.get('request_id'), data.get('complete', True),
+                          len(message))
+
+
+def expand_top_k_blocks(blocks: list[dict]) -> list[dict]:
+    """Top k similarity (see Observe.top_k) comes as values block followed by indices block. Keys outside top k are
+    drawn at 0, so lines of all keys can be indexed as usual"""
+    result = []
+    for block in blocks:
+        if block.get('top_k_indices'):
+            values = result[-1]
+            values['value'] = nengo_3d_frames.expand_top_k(block['value'], values['value'], values['size'], fill=0.0)
+            continue
+        result.append(block)
+    return result
 
-    if data:
-        message = data
-        logger.debug(f'Incoming: {message[:1000]}')
-        start = time.time()
-        handle_single_packet(message, scene)
-        end = time.time()
-        execution_times.append(end - start)
 
-    return update_interval
+def handle_handshake(incoming_answer: dict):
+    data_scheme = schemas.Handshake()
+    data = data_scheme.load(data=incoming_answer['data'])
+    share_data.compression = nengo_3d_frames.Compression(method=data['compression'],
+                                                         level=data['compression_level'],
+                                                         threshold=data['compression_threshold'])
+    logger.info(f'Agreed compression: {share_data.compression}')
+    share_data.close_shared_memory()
+    if data.get('shared_memory_name'):
+        try:
+            share_data.shared_memory = nengo_3d_shm.SharedMemoryRing.attach(data['shared_memory_name'])
+        except (OSError, ValueError) as e:
+            # server is on different machine, ask to send everything through socket
+            logger.warning(f'Can not attach to shared memory {data["shared_memory_name"]}: {e}')
+            data.update(shared_memory=False, shared_memory_name=None)
+            mess = schemas.Message().dumps({'schema': schemas.Handshake.__name__, 'data': data_scheme.dump(data)})
+            share_data.sendall(mess.encode('utf-8'))
+        else:
+            logger.info(f'Using shared memory: {share_data.shared_memory.name}')
+    share_data.subscriber = data.get('subscriber', False)
+    if share_data.subscriber:
+        logger.info('Subscribed to simulation controlled by other client')
+    share_data.credit_window = (data['credit_frames'], data['credit_bytes'])
+    share_data.consumed_frames = 0
+    share_data.consumed_bytes = 0
+    if data['credit_frames']:
+        logger.info(f'Flow control: {data["credit_frames"]} frames, {data["credit_bytes"] / 1024 / 1024:.1f}Mb')
+
+
+def decode_shared_memory_block(incoming_answer: dict) -> Optional[DecodedMessage]:
+    data = schemas.SharedMemoryBlock().load(data=incoming_answer['data'])
+    if not share_data.shared_memory:
+        logger.error(f'Shared memory is not attached, lost message: {data}')
+        return undecoded_steps(data['size'])  # only steps are sent through shared memory
+    try:
+        # arrays are decoded as views on shared memory and copied before memory is released
+        return decode_binary(share_data.shared_memory.read(data['position'], data['size']))
+    finally:
+        share_data.shared_memory.release(data['position'], data['size'])
 
 
-def handle_single_packet(message: str, scene: str):
-    # from bl_nengo_3d.digraph_model import DiGraphModel
+def apply_message(message: DecodedMessage, scene: str):
+    """Runs on main thread, applies decoded message to blender data"""
     scene = bpy.data.scenes[scene]
     nengo_3d: Nengo3dProperties = scene.nengo_3d
-    answer_schema = schemas.Message()
-    incoming_answer: dict = answer_schema.loads(message)  # json.loads(message)
-    if incoming_answer['schema'] == schemas.NetworkSchema.__name__:
-        handle_network_schema(incoming_answer, scene=scene)
-    elif incoming_answer['schema'] == schemas.SimulationSteps.__name__:
-        handle_simulation_steps(incoming_answer, nengo_3d)
-    elif incoming_answer['schema'] == schemas.PlotLines.__name__:
-        handle_plot_lines(incoming_answer, nengo_3d)
+    if message.schema == schemas.NetworkSchema.__name__:
+        handle_network_schema(*message.data, scene=scene)
+    elif message.schema == schemas.Credit.__name__:
+        share_data.consume_credit(message.size)  # steps that could not be decoded, see undecoded_steps
+    elif message.schema == schemas.SimulationSteps.__name__:
+        share_data.consume_credit(message.size)
+        if message.request_id is not None:
+            if message.request_id not in share_data.pending_requests:
+                logger.debug(f'Dropped answer to cancelled request: {message.request_id}')
+                return
+            if message.complete:
+                del share_data.pending_requests[message.request_id]
+        cache_simulation_steps(message.data, nengo_3d)
+        if message.request_id is not None and message.request_id == share_data.live_request:
+            # real-time playback shows the newest pushed step
+            scene.frame_current = max(share_data.current_step, 0) * nengo_3d.sample_every
+            if message.complete:
+                share_data.live_request = None
+    elif message.schema == schemas.SimulationStopped.__name__:
+        step = message.data['step']
+        error = message.data.get('error')
+        if error:
+            # failed request is answered, later requests are still computed
+            logger.error(f'Simulation of request {message.request_id} failed at step {step}: {error}')
+            share_data.pending_requests.pop(message.request_id, None)
+        else:
+            logger.info(f'Simulation stopped at step {step}')
+        # requests sent before stop are answered, requests sent after it will be answered later
+        # broadcast by server without request_id: simulation of other client was reset or seeked
+        if message.request_id is not None:
+            for request_id in [i for i in share_data.pending_requests if i < message.request_id]:
+                del share_data.pending_requests[request_id]
+        if share_data.live_request not in share_data.pending_requests:
+            share_data.live_request = None
+        if not share_data.pending_requests:
+            share_data.requested_steps_until = step
+        # after seek, steps after checkpoint will be computed again
+        share_data.current_step = min(share_data.current_step, step // nengo_3d.sample_every - 1)
+    elif message.schema == schemas.PlotLines.__name__:
+        handle_plot_lines(message.data, nengo_3d)
+    elif message.schema == schemas.SweepRun.__name__:
+        run = message.data
+        share_data.sweep_runs[run['run']] = run
+        if run['state'] == 'failed':
+            logger.error(f'Sweep run {run["run"]} ({run["parameter"]}) failed: {run["error"]}')
+    elif message.schema == schemas.BuildReport.__name__:
+        share_data.build_report = message.data
+        solved = sum(1 for obj in message.data['objects'] if obj['cached'] is False)
+        logger.info(f'Simulator built in {message.data["time"]:.2f}s, {solved} decoders solved')
     else:
-        logger.error(f'Unknown schema: {incoming_answer["schema"]}')
+        logger.error(f'Unknown schema: {message.schema}')
 
 
-def handle_plot_lines(incoming_answer: dict, nengo_3d: Nengo3dProperties):
+def handle_plot_lines(data: dict, nengo_3d: Nengo3dProperties):
     from bl_nengo_3d.bl_properties import LineSourceProperties
     from bl_nengo_3d.frame_change_handler import get_xyzdata
-    data_scheme = schemas.PlotLines()
-    data = data_scheme.load(data=incoming_answer['data'])
     source = data['source']
     access_path = data['access_path']
     axes = share_data.charts[source]
-    data = np.array(data['data'])
+    data = data['data']
     for ax in axes:
         for line_prop in ax.lines:
             line_source: LineSourceProperties = line_prop.source
@@ -103,12 +344,8 @@ def handle_plot_lines(incoming_answer: dict, nengo_3d: Nengo3dProperties):
         ax.draw()
 
 
-def handle_network_schema(incoming_answer: dict, scene: bpy.types.Scene):
-    from bl_nengo_3d.digraph_model import GraphModel
+def handle_network_schema(g: 'GraphModel', data: dict, scene: bpy.types.Scene):
     nengo_3d: Nengo3dProperties = scene.nengo_3d
-    data_scheme = schemas.NetworkSchema()
-    g, data = data_scheme.load(data=incoming_answer['data'])
-    g: GraphModel
     share_data.model_graph = g
     for subnet in g.list_subnetworks():
         item = nengo_3d.expand_subnetworks.get(subnet.name)
@@ -138,17 +375,24 @@ def handle_network_schema(incoming_answer: dict, scene: bpy.types.Scene):
             t.write(line)
 
 
-def handle_simulation_steps(incoming_answer, nengo_3d: Nengo3dProperties):
-    data_scheme = schemas.SimulationSteps(many=True)
-    data = data_scheme.load(data=incoming_answer['data'])
-    for simulation_step in sorted(data, key=lambda sim_step: sim_step['step']):
-        share_data.current_step = simulation_step['step']
-        parameters = simulation_step.get('parameters')
-        if not parameters:
+def cache_simulation_steps(blocks: list[dict], nengo_3d: Nengo3dProperties):
+    """Append whole blocks to simulation cache. Block is dict with node_name, access_path, start, stride and value"""
+    for block in blocks:
+        value = block['value']
+        if block.get('ever_top_k'):
+            bl_plot_operators.add_top_k_lines(block['node_name'], block['access_path'], block['ever_top_k'])
+        if len(value) == 0:
+            continue
+        if block.get('run') is not None:
+            share_data.sweep_cache[block['run']][block['node_name'], block['access_path']].extend(
+                value, start=block['start'])
             continue
-        node_name = simulation_step['node_name']
-        for access_path, value in parameters.items():
-            share_data.simulation_cache[node_name, access_path].append(np.array(value))
+        cache = share_data.simulation_cache[block['node_name'], block['access_path']]
+        if len(cache) != block['start']:
+            logger.debug(f'{block["node_name"]}.{block["access_path"]}: received steps from {block["start"]}, '
+                         f'but {len(cache)} steps are cached')
+        cache.extend(value, start=block['start'])
+        share_data.current_step = max(share_data.current_step, block['start'] + len(value) - 1)
     if share_data.step_when_ready != 0 and not nengo_3d.allow_scrubbing:
         bpy.context.scene.frame_current = share_data.step_when_ready
         share_data.step_when_ready = 0
@@ -23,6 +23,7 @@ class ReloadAddonOperator(bpy.types.Operator):
             if share_data.handle_data and bpy.app.timers.is_registered(share_data.handle_data):
                 bpy.app.timers.unregister(share_data.handle_data)
                 share_data.handle_data = None
+            share_data.stop_receiver()
             share_data.client.shutdown(socket.SHUT_RDWR)
             share_data.client.close()
             share_data.client = None
@@ -33,6 +33,21 @@ class NengoDebugPanel(bpy.types.Panel):
                  f'max: {connection_handler.execution_times.max():.2f}')
         if share_data.simulation_cache:
             layout.label(text=f'Cached steps: {share_data.simulation_cache_steps()}')
+        layout.label(text=f'Timer ticks, last {connection_handler.tick_times.max_items} avg: '
+                          f'{connection_handler.tick_times.average() * 1000:.1f}ms, '
+                          f'max: {connection_handler.tick_times.max() * 1000:.1f}ms, '
+                          f'queued messages: {connection_handler.queue_depth}')
+        layout.prop(context.scene.nengo_3d, 'receive_budget')
+        layout.prop(context.scene.nengo_3d, 'message_encoding')
+        if share_data.receiver:
+            layout.label(text=f'Decoding, last {share_data.receiver.decode_times.max_items} avg: '
+                              f'{share_data.receiver.decode_times.average():.2f}, '
+                              f'max: {share_data.receiver.decode_times.max():.2f}')
+        if share_data.receiver and share_data.receiver.frame_reader.raw_bytes:
+            reader = share_data.receiver.frame_reader
+            layout.label(text=f'Received: {reader.wire_bytes / 1024 / 1024:.2f}Mb, '
+                              f'uncompressed: {reader.raw_bytes / 1024 / 1024:.2f}Mb '
+                              f'({reader.wire_bytes / reader.raw_bytes:.1%}), {share_data.compression.method}')
         col = layout.column(align=True)
         # col.operator(DebugPlotLine.bl_idname, text='Plot 2d').dim = 2
         # col.operator(DebugPlotLine.bl_idname, text='Plot 3d').dim = 3
@@ -116,11 +131,8 @@ class NengoSimulationCachePanel(bpy.types.Panel):
         row.label(text=f'First value')
         for param, value in sorted(share_data.simulation_cache.items()):
             row = col.row()
-            value: list
-            if len(value) > 0:
-                dim = value[0].shape
-            else:
-                dim = len(value[0])
+            value: 'StepCache'
+            dim = value[0].shape if len(value) > 0 else None
             row.label(text=f'{str(param)}, dim={dim if value else "?"}, len={len(value)}')
             row.label(text=f'{value[0]}, ...' if value else "?")
 
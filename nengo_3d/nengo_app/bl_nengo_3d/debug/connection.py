@@ -29,5 +29,5 @@ class DebugConnectionOperator(bpy.types.Operator):
         return share_data.client is not None
 
     def execute(self, context):
-        share_data.client.send(self.message.encode('utf-8'))
+        share_data.sendall(self.message.encode('utf-8'))
         return {'FINISHED'}
@@ -43,11 +43,11 @@ def frame_change_handler(scene: bpy.types.Scene):
                                                       sample_every=nengo_3d.sample_every, dt=nengo_3d.dt, prefetch=0)
                 # share_data.requested_steps_until = frame_current
     else:
-        if frame_current > (share_data.simulation_cache_steps() or 0) * nengo_3d.sample_every:
-            scene.frame_current = (share_data.simulation_cache_steps() or 0) * nengo_3d.sample_every
+        if frame_current > (share_data.cached_steps() or 0) * nengo_3d.sample_every:
+            scene.frame_current = (share_data.cached_steps() or 0) * nengo_3d.sample_every
             frame_current = scene.frame_current
 
-    if not share_data.simulation_cache_steps() or frame_current > 1 + share_data.simulation_cache_steps() * nengo_3d.sample_every:
+    if not share_data.cached_steps() or frame_current > 1 + share_data.cached_steps() * nengo_3d.sample_every:
         # logging.debug(f'Aborted: {frame_current}, {share_data.simulation_cache_steps()}')
         return
 
@@ -78,8 +78,16 @@ def frame_change_handler(scene: bpy.types.Scene):
 
 def update_plots(nengo_3d: Nengo3dProperties, start_entries: int, end_entries: int, steps: list[int]):
     # debugged = False
-    for (obj_name, access_path), _data in share_data.simulation_cache.items():
-        data = _data[start_entries:end_entries]  # ugh, copy
+    caches = [(-1, share_data.simulation_cache), *share_data.sweep_cache.items()]
+    for run, cache in caches:
+        update_plots_from_cache(nengo_3d, run, cache, start_entries, end_entries, steps)
+
+
+def update_plots_from_cache(nengo_3d: Nengo3dProperties, run: int, cache: dict[tuple[str, str], 'StepCache'],
+                            start_entries: int, end_entries: int, steps: list[int]):
+    """Update lines showing `run` of sweep, -1 is interactive simulation"""
+    for (obj_name, access_path), _data in cache.items():
+        data = _data[start_entries:end_entries]  # view, no copy
         # if not debugged:
         # logging.debug((start_entries, end_entries, steps, len(data)))
         # debugged = True
@@ -90,7 +98,7 @@ def update_plots(nengo_3d: Nengo3dProperties, start_entries: int, end_entries: i
             for line_prop in ax.lines:
                 line_prop: LineProperties
                 line_source: LineSourceProperties = line_prop.source
-                if not line_prop.update or line_source.access_path != access_path:
+                if not line_prop.update or line_source.access_path != access_path or line_source.run != run:
                     continue
                 l = ax.get_line(line_prop)
                 xdata, ydata, zdata = get_xyzdata(data, steps, line_prop, nengo_3d)
@@ -113,7 +121,7 @@ def recolor_dynamic_node_attributes(nengo_3d: Nengo3dProperties, step: int):
         node_data = share_data.model_graph.get_node_or_subnet_data(node)
         obj: bpy.types.Object = bpy.data.objects[node_data['_blender_object_name']]
         all_data = share_data.simulation_cache.get((node, nengo_3d.node_dynamic_access_path))
-        if not all_data:
+        if not all_data or step >= len(all_data):  # sweep runs can be longer than interactive simulation
             obj.nengo_attributes.color = (0.0, 0.0, 0.0)
             obj.update_tag()
             continue
@@ -174,7 +182,7 @@ def recolor_dynamic_edge_attributes(nengo_3d: Nengo3dProperties, step: int):
         e_data = share_data.model_graph.edges[e_data['pre'], e_data['post'], key]
         obj: bpy.types.Object = bpy.data.objects[e_data['_blender_object_name']]
         all_data = share_data.simulation_cache.get((e_data['name'], nengo_3d.edge_dynamic_access_path))
-        if not all_data:
+        if not all_data or step >= len(all_data):  # sweep runs can be longer than interactive simulation
             obj.nengo_attributes.color = (0.0, 0.0, 0.0)
             obj.update_tag()
             continue
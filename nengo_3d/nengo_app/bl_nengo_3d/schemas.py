@@ -4,10 +4,17 @@ import nengo_3d_schemas
 from marshmallow import post_load, pre_dump
 
 Message = nengo_3d_schemas.Message
+Handshake = nengo_3d_schemas.Handshake
+Credit = nengo_3d_schemas.Credit
+SharedMemoryBlock = nengo_3d_schemas.SharedMemoryBlock
 Observe = nengo_3d_schemas.Observe
 SimulationSteps = nengo_3d_schemas.SimulationSteps
 Simulation = nengo_3d_schemas.Simulation
+SimulationStopped = nengo_3d_schemas.SimulationStopped
 PlotLines = nengo_3d_schemas.PlotLines
+BuildReport = nengo_3d_schemas.BuildReport
+Sweep = nengo_3d_schemas.Sweep
+SweepRun = nengo_3d_schemas.SweepRun
 
 # class PlotLines(nengo_3d_schemas.PlotLines):
 #     @pre_dump
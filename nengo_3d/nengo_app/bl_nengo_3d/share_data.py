@@ -1,15 +1,18 @@
 import logging
 import socket
-import struct
+import threading
 from collections import defaultdict
 from typing import *
 
 import bpy
 import networkx as nx
 import collections
+import nengo_3d_frames
+import nengo_3d_shm
 
 from bl_nengo_3d import colors
 from bl_nengo_3d.axes import Axes, Line
+from bl_nengo_3d.step_cache import StepCache
 
 
 class _ShareData:
@@ -22,6 +25,14 @@ class _ShareData:
         # self.run_id = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
         # self.session_id = 0  # For logging and debug
         self.client: Optional[socket.socket] = None
+        self.receiver: Optional['bl_nengo_3d.connection_handler.Receiver'] = None
+        """Background thread reading from client"""
+        self._send_lock = threading.Lock()
+        """Main thread and receiver can both send messages"""
+        self.compression = nengo_3d_frames.Compression()
+        """Compression of sent frames, agreed with server on handshake"""
+        self.shared_memory: Optional[nengo_3d_shm.SharedMemoryRing] = None
+        """Shared memory with simulation steps, created by server on handshake"""
         self.handle_data: Optional[Callable] = None
         """This is handle for unregistering function. This function is created using functools.partial thus 
         
@@ -35,9 +46,9 @@ class _ShareData:
         self.model_graph_view: Optional[nx.MultiDiGraph] = None
         self.charts: dict[str, list[Axes]] = defaultdict(list)
         # self.simulation_cache_step = list()
-        self.simulation_cache = defaultdict(list)
+        self.simulation_cache: dict[tuple[str, str], StepCache] = defaultdict(StepCache)
         """
-        dict[(object, access_path), list[data]] ]
+        dict[(object, access_path), StepCache] - [n_steps, dims] data for each observed object
         """
         self.step_when_ready = 0
         """
@@ -47,21 +58,83 @@ class _ShareData:
         """buggy... sometimes we need to wait for data during playback. We need to temporarily stop and then resume"""
         self.requested_steps_until = -1
         self.current_step = -1
+        self.next_request_id = 0
+        self.pending_requests: dict[int, int] = {}
+        """request_id: until, step requests sent to server and waiting for answer"""
+        self.live_request: Optional[int] = None
+        """Request id of real-time playback, server pushes steps with it until stopped"""
+        self.subscriber = False
+        """Server broadcasts simulation controlled by other client, requests of this client are ignored"""
+        self.credit_window: tuple[int, int] = (0, 0)
+        """(frames, bytes) of flow control window agreed on handshake, zero frames when flow control is disabled"""
+        self.consumed_frames = 0
+        self.consumed_bytes = 0
+        """SimulationSteps messages applied since credit was last granted to server"""
+        self.sweep_runs: dict[int, dict] = {}
+        """run: last SweepRun message of every run of sweep"""
+        self.sweep_cache: dict[int, dict[tuple[str, str], StepCache]] = defaultdict(lambda: defaultdict(StepCache))
+        """run: (object, access_path): StepCache - runs of sweep kept side by side, see simulation_cache"""
+        self.observe_top_k: dict[tuple[str, str], int] = {}
+        """(source, access_path): k of similarity observed only for top k keys, updated by get_all_sources"""
+        self.build_report: Optional[dict] = None
+        """Last BuildReport sent by server: build time of ensembles and connections"""
 
     def sendall(self, msg: bytes):
         try:
-            self.client.sendall(struct.pack("i", len(msg)) + msg)
+            with self._send_lock:
+                nengo_3d_frames.send_frame(self.client, msg, self.compression)
             return True
         except OSError as e:
             logging.exception(e)
             return False
 
+    def new_request(self, until: Optional[int] = None) -> int:
+        """Reserve request id. If until is given, request is tracked until server answers it"""
+        request_id = self.next_request_id
+        self.next_request_id += 1
+        if until is not None:
+            self.pending_requests[request_id] = until
+            self.requested_steps_until = max(self.requested_steps_until, until)
+        return request_id
+
+    def consume_credit(self, size: int):
+        """Grant credit back to server once half of the window was consumed"""
+        frames, window_bytes = self.credit_window
+        if not frames:
+            return
+        self.consumed_frames += 1
+        self.consumed_bytes += size
+        if self.consumed_frames >= max(frames // 2, 1) or self.consumed_bytes >= window_bytes // 2:
+            from bl_nengo_3d.schemas import Credit, Message
+            mess = Message().dumps({'schema': Credit.__name__,
+                                    'data': Credit().dump({'frames': self.consumed_frames,
+                                                           'bytes': self.consumed_bytes})})
+            self.sendall(mess.encode('utf-8'))
+            self.consumed_frames = 0
+            self.consumed_bytes = 0
+
+    def stop_receiver(self):
+        if self.receiver:
+            self.receiver.stop()
+            self.receiver.join(timeout=1)
+            self.receiver = None
+
+    def close_shared_memory(self):
+        if self.shared_memory:
+            self.shared_memory.close()
+            self.shared_memory = None
+
     def simulation_cache_steps(self):
         if self.simulation_cache:
             cached_steps = max(len(i) for i in self.simulation_cache.values())
             return cached_steps
         return None
 
+    def cached_steps(self):
+        """Like simulation_cache_steps, but includes runs of sweep"""
+        lengths = [len(i) for cache in [self.simulation_cache, *self.sweep_cache.values()] for i in cache.values()]
+        return max(lengths) if lengths else None
+
     def register_chart(self, ax: Axes):
         axes = self.charts[ax._nengo_axes.model_source]
         if ax not in axes:
@@ -77,25 +150,44 @@ class _ShareData:
         from bl_nengo_3d.bl_properties import LineProperties, Nengo3dProperties
         from bl_nengo_3d.bl_properties import LineSourceProperties
         nengo_3d: Nengo3dProperties
-        observe = set()
+        observe: dict[tuple[str, str], str] = {}
+        """(source, access_path): precision"""
         plot = set()
+        top_k: dict[tuple[str, str], int] = {}
+        all_keys = set()
+
+        def add_observe(source: str, access_path: str, precision: str):
+            # the same data can be used by many consumers, send it with the best precision
+            current = observe.get((source, access_path), precision)
+            observe[source, access_path] = min(current, precision, key=nengo_3d_frames.PRECISIONS.index)
+
         if self.model_graph_view and nengo_3d.node_color == 'MODEL_DYNAMIC':
             for node, node_data in self.model_graph_view.nodes(data=True):
                 # todo check if node has this path
-                observe.add((node, nengo_3d.node_dynamic_access_path))
+                add_observe(node, nengo_3d.node_dynamic_access_path, nengo_3d.node_dynamic_precision)
         if self.model_graph_view and nengo_3d.edge_color == 'MODEL_DYNAMIC':
             for e_source, e_target, key, e_data in self.model_graph_view.edges(data=True, keys=True):
                 e_data = self.model_graph.edges[e_data['pre'], e_data['post'], key]
-                observe.add((e_data['name'], nengo_3d.edge_dynamic_access_path))
+                add_observe(e_data['name'], nengo_3d.edge_dynamic_access_path, nengo_3d.edge_dynamic_precision)
         for source, axes in self.charts.items():
             for ax in axes:
+                nengo_axes = ax._nengo_axes
+                if nengo_axes.top_k:
+                    # lines are added later, when their keys get among top k
+                    key = (nengo_axes.model_source, nengo_axes.top_k_access_path)
+                    add_observe(*key, 'float32')
+                    top_k[key] = max(top_k.get(key, 0), nengo_axes.top_k)
+                    continue
                 for line in ax.lines:
                     line: LineProperties
                     line_source: LineSourceProperties = line.source
                     if line_source.iterate_step:
-                        observe.add((line_source.source_obj, line_source.access_path))
+                        add_observe(line_source.source_obj, line_source.access_path, line_source.precision)
+                        all_keys.add((line_source.source_obj, line_source.access_path))
                     else:
                         plot.add((line_source.source_obj, line_source.access_path, line_source.fixed_step))
+        # other chart shows every key
+        self.observe_top_k = {key: k for key, k in top_k.items() if key not in all_keys}
         return observe, plot
 
 
@@ -0,0 +1,63 @@
+from typing import Iterator, Optional
+
+import numpy as np
+
+
+class StepCache:
+    """Growable [n_steps, dims] array for data of one (node, access_path).
+
+    Whole blocks of steps are appended at once, indexing and slicing return views (no copy).
+    """
+
+    def __init__(self, initial_capacity: int = 1024):
+        self.initial_capacity = initial_capacity
+        self._data: Optional[np.ndarray] = None
+        self._size = 0
+
+    @property
+    def data(self) -> np.ndarray:
+        if self._data is None:
+            return np.empty((0,))
+        return self._data[:self._size]
+
+    def _reserve(self, size: int, block: np.ndarray) -> None:
+        if self._data is None:
+            self._data = np.empty((max(size, self.initial_capacity), *block.shape[1:]), dtype=block.dtype)
+        elif size > len(self._data):
+            new_data = np.empty((max(size, 2 * len(self._data)), *self._data.shape[1:]), dtype=self._data.dtype)
+            new_data[:self._size] = self._data[:self._size]
+            self._data = new_data
+
+    def extend(self, block: np.ndarray, start: Optional[int] = None) -> None:
+        """Append block. If start is given, block is placed at this row: later rows are dropped (simulation went back
+        to earlier step) or missing rows are filled with nan (simulation was resumed from checkpoint)"""
+        block = np.asarray(block)
+        if len(block) == 0:
+            return
+        if start is not None and start < self._size:
+            self._size = start
+        elif start is not None and start > self._size:
+            gap = np.full((start - self._size, *block.shape[1:]), np.nan)
+            self.extend(gap.astype(block.dtype) if block.dtype.kind == 'f' else np.zeros_like(gap, dtype=block.dtype))
+        self._reserve(self._size + len(block), block)
+        self._data[self._size:self._size + len(block)] = block
+        self._size += len(block)
+
+    def append(self, row: np.ndarray) -> None:
+        self.extend(np.asarray(row)[np.newaxis])
+
+    def clear(self) -> None:
+        self._data = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, item):
+        return self.data[item]
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        return iter(self.data)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(shape={self.data.shape}, dtype={self.data.dtype})'
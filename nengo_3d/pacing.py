@@ -0,0 +1,58 @@
+"""Real-time playback pushed by server.
+
+Simulation follows wall clock: after `t` seconds of playback it is at `rate * t` simulated seconds. Every `1 / fps`
+seconds server simulates up to the current target step and pushes the new steps to client. When simulation or client
+can not keep up, frames carry only the newest steps, older ones are skipped (client sees gaps in plots).
+"""
+import time
+from typing import Callable
+
+
+class Pacer:
+    """Wall clock schedule of real-time playback"""
+
+    def __init__(self, rate: float, fps: float, dt: float, sample_every: int, start_step: int, max_lag: float = 1.0,
+                 clock: Callable[[], float] = time.perf_counter):
+        self.rate = rate
+        """Simulated seconds per wall clock second"""
+        self.period = 1 / fps
+        self.dt = dt
+        self.sample_every = sample_every
+        self.max_lag = max_lag
+        """Wall clock seconds simulation can fall behind, then schedule is moved instead of catching up"""
+        self.clock = clock
+        self.anchor_time = clock()
+        self.anchor_step = start_step
+        self.next_tick = self.anchor_time
+        self.skipped_steps = 0
+        """Steps simulated, but not sent, because simulation or client was behind"""
+
+    @property
+    def frame_steps(self) -> int:
+        """Simulation steps in one frame at target rate, at least one recorded step"""
+        steps = int(self.rate * self.period / self.dt)
+        return max(steps - steps % self.sample_every, self.sample_every)
+
+    def delay(self) -> float:
+        """Seconds until next frame is due"""
+        return self.next_tick - self.clock()
+
+    def target(self, now: float) -> int:
+        """Recorded step simulation should reach at wall clock time now"""
+        step = self.anchor_step + int((now - self.anchor_time) * self.rate / self.dt)
+        return step - step % self.sample_every
+
+    def lag(self, step: int, now: float) -> float:
+        """Wall clock seconds simulation is behind schedule"""
+        return max(self.target(now) - step, 0) * self.dt / self.rate
+
+    def tick(self, step: int, now: float) -> bool:
+        """Schedule next frame. Returns True if simulation at step was too far behind and schedule was moved"""
+        self.next_tick += self.period
+        if self.next_tick < now:
+            self.next_tick = now + self.period  # missed frames are not made up
+        if self.lag(step, now) > self.max_lag:
+            self.anchor_time = now
+            self.anchor_step = step
+            return True
+        return False
@@ -5,57 +5,95 @@ from typing import Union, Optional
 import nengo
 import nengo.spa.module
 import nengo_spa
+import numpy as np
 
 from marshmallow import pre_dump
 
 import nengo_3d.nengo_3d_schemas as nengo_3d_schemas
+from nengo_3d import nengo_3d_frames
+from nengo_3d.history import ProbeHistory
 from nengo_3d.name_finder import NameFinder
-from nengo_3d.nengo_3d_schemas import Message, Observe, Simulation, PlotLines
+from nengo_3d.nengo_3d_schemas import Message, Handshake, Credit, SharedMemoryBlock, Observe, Simulation, PlotLines, \
+    SimulationStopped, BuildReport, Sweep, SweepRun
 
 Message = Message
+Handshake = Handshake
+Credit = Credit
+SharedMemoryBlock = SharedMemoryBlock
 Observe = Observe
 Simulation = Simulation
+SimulationStopped = SimulationStopped
 PlotLines = PlotLines
+BuildReport = BuildReport
+Sweep = Sweep
+SweepRun = SweepRun
 
 
 class SimulationSteps(nengo_3d_schemas.SimulationSteps):
     @pre_dump(pass_many=True)
-    def get_parameters(self, sim_data: nengo.simulator.SimulationData, many: bool):
+    def get_parameters(self, sim_data: "nengo.simulator.SimulationData", many: bool):
         assert many is True, 'many=False is not supported'
+        return [{**meta, 'data': block.tolist()} for meta, block in self.get_blocks(sim_data)]
+
+    def get_blocks(self, sim_data: "nengo.simulator.SimulationData") -> list[tuple[dict, np.ndarray]]:
+        """One [n_steps, dims] array per (node_name, access_path). Use with `nengo_3d_frames.dumps_arrays`"""
         name_finder: NameFinder = self.context['name_finder']
-        sim: nengo.Simulator = self.context['sim']
-        model: nengo.Network = self.context['model']
         vocab: dict[nengo.base.NengoObject, nengo.spa.Vocabulary] = self.context['vocab']
         recorded_steps: list[int] = self.context['recorded_steps']
         sample_every: int = self.context['sample_every']
         requested_probes: dict[nengo.base.NengoObject, list['RequestedProbes']] = self.context['requested_probes']
+        if not recorded_steps:
+            return []
+        start = int(recorded_steps[0] / sample_every)
+        end = start + len(recorded_steps)
+        first_row = self.context.get('history_start', 0) // sample_every
+        """Probes of simulator resumed from checkpoint do not have rows for earlier steps"""
+        history: ProbeHistory = self.context['history']
         results = []
         try:
-            for step in recorded_steps:
-                step = int(step / sample_every)
-                for obj, probes in requested_probes.items():
-                    _result = {'step': step, 'parameters': {}, 'node_name': name_finder.name(obj)}
-                    for probe, access_path, _, _ in probes:
-                        probe: nengo.Probe
-                        # sim.trange()
-                        # logging.debug((probe, recorded_steps, step, sample_every, len(sim_data[probe])))
-                        if access_path.endswith('similarity'):
-                            _vocab = vocab.get(probe.obj)
-                            # _vocab = vocab.get(probe.obj.size_out) if _vocab is None else _vocab
-                            if isinstance(model, nengo_spa.Network):
-                                # legacy version
-                                _result['parameters'][access_path] = nengo_spa.similarity(data=sim_data[probe][step],
-                                                                                          vocab=_vocab).tolist()
-                            else:
-                                _result['parameters'][access_path] = nengo.spa.similarity(data=sim_data[probe][step],
-                                                                                          vocab=_vocab)[0].tolist()
-                        else:
-                            _result['parameters'][access_path] = sim_data[probe][step].tolist()
-                    results.append(_result)
+            for obj, probes in requested_probes.items():
+                node_name = name_finder.name(obj)
+                for rp in probes:
+                    probe: nengo.Probe = rp.probe
+                    access_path = rp.access_path
+                    # only requested rows, sim_data[probe] would convert whole history
+                    data = history.rows(probe, start - first_row, end - first_row)
+                    if access_path.endswith('similarity'):
+                        _vocab = vocab.get(probe.obj)
+                        if _vocab is None:
+                            _vocab = vocab.get(probe.obj.size_out)
+                        # [n_steps, D] x [D, n_keys] at once, equal to nengo similarity of every step
+                        data = data @ self._vocab_matrix(_vocab)
+                    meta = {'node_name': node_name, 'access_path': access_path, 'start': start,
+                            'stride': sample_every}
+                    if rp.top_k:
+                        results.extend(self._top_k_blocks(meta, data, rp.top_k, rp.precision))
+                        continue
+                    data, precision_meta = nengo_3d_frames.quantize(data, rp.precision)
+                    results.append(({**meta, **precision_meta}, data))
         except KeyError as e:
             logging.error(f'No such key: {e}: {list(sim_data.keys())}')
         return results
 
+    def _top_k_blocks(self, meta: dict, data: np.ndarray, k: int, precision: str) -> list[tuple[dict, np.ndarray]]:
+        """Values and indices of k most similar keys, instead of [n_steps, n_keys] block"""
+        indices, values = nengo_3d_frames.top_k(data, k)
+        ever = self.context['ever_top_k'][meta['node_name'], meta['access_path']]
+        ever.update(np.unique(indices).tolist())
+        values, precision_meta = nengo_3d_frames.quantize(values, precision)
+        return [({**meta, **precision_meta, 'top_k': k, 'size': data.shape[1], 'ever_top_k': sorted(ever)}, values),
+                ({**meta, 'top_k_indices': True}, indices)]
+
+    def _vocab_matrix(self, vocab: Union[nengo.spa.Vocabulary, nengo_spa.Vocabulary]) -> np.ndarray:
+        """[D, n_keys] matrix of vocabulary vectors, cached in context['vocab_matrices'] until keys are added"""
+        cache: dict[int, tuple[object, int, np.ndarray]] = self.context.setdefault('vocab_matrices', {})
+        vectors = vocab.vectors
+        cached = cache.get(id(vocab))
+        if cached is None or cached[0] is not vocab or cached[1] != len(vectors):
+            cached = (vocab, len(vectors), np.ascontiguousarray(np.asarray(vectors, dtype=np.float64).T))
+            cache[id(vocab)] = cached
+        return cached[2]
+
 
 class ConnectionSchema(nengo_3d_schemas.ConnectionSchema):
     @pre_dump
@@ -0,0 +1,164 @@
+"""Simulation of many variants of one model (e.g. seeds) in worker processes.
+
+Every run builds its own model with `model_factory(parameter)`, the factory must be picklable (module level function
+or `functools.partial` of it). Objects are found by names given by `NameFinder(terms={'model': model})`, so the factory
+has to create the same structure for every parameter.
+"""
+import logging
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, Future, CancelledError
+from typing import Any, Callable, NamedTuple, Optional, Sequence
+
+import nengo
+import nengo.builder
+import nengo.cache
+import numpy as np
+
+import nengo_3d.utils
+from nengo_3d import nengo_3d_frames
+from nengo_3d.builder import SimulatorOptions, signal_precision
+from nengo_3d.history import probe_data
+from nengo_3d.name_finder import NameFinder
+import nengo_3d.schemas as schemas
+
+logger = logging.getLogger(__name__)
+
+message = schemas.Message()
+
+
+class SweepProbe(NamedTuple):
+    source: str
+    """Name known to client"""
+    access_path: str
+    canonical_source: str
+    """Name of the same object in model created by factory"""
+    precision: str = 'float64'
+
+
+def simulate_run(model_factory: Callable[[Any], nengo.Network], parameter: Any, run: int, probes: list[SweepProbe],
+                 until: int, dt: float, sample_every: int, chunk_steps: int, decoder_cache_dir: Optional[str],
+                 options: SimulatorOptions, results: queue.Queue, stop: threading.Event) -> int:
+    """Runs in worker process. Puts ('started', run) and ('steps', run, start, [array per probe]) on results.
+
+    Returns number of simulated steps.
+    """
+    results.put(('started', run))
+    model = model_factory(parameter)
+    name_finder = NameFinder(terms={'model': model}, model=model)
+    nengo_probes = []
+    with model:
+        for probe in probes:
+            access_path = probe.access_path.split('.')
+            to_probe = nengo_3d.utils.get_value(name_finder.object(probe.canonical_source), access_path[:-2])
+            nengo_probes.append(nengo.Probe(to_probe, access_path[-1], sample_every=sample_every * dt, synapse=0.01))
+    decoder_cache = nengo.cache.DecoderCache(cache_dir=decoder_cache_dir) if decoder_cache_dir else None
+    builder_model = nengo.builder.Model(dt=dt, label=f'run {run}: {parameter}', decoder_cache=decoder_cache)
+    with signal_precision(options.dtype):
+        sim = nengo.Simulator(model, dt=dt, model=builder_model, progress_bar=False, optimize=options.optimize)
+    with sim:
+        sent = 0
+        chunk = max(chunk_steps - chunk_steps % sample_every, sample_every)
+        while sim.n_steps < until and not stop.is_set():
+            sim.run_steps(min(chunk, until - sim.n_steps), progress_bar=False)
+            data = probe_data(sim)
+            rows = len(data[nengo_probes[0]]) if nengo_probes else sent
+            if rows > sent:
+                results.put(('steps', run, sent, [np.asarray(data[p][sent:rows]) for p in nengo_probes]))
+                sent = rows
+        return sim.n_steps
+
+
+class SweepRunner(threading.Thread):
+    """Submits every sweep parameter of server to process pool and streams results of runs to client.
+
+    Steps are sent as SimulationSteps blocks with `run` set, progress of runs as SweepRun messages.
+    """
+
+    def __init__(self, connection: 'nengo_3d.gui.GuiConnection', request_id: Optional[int], probes: list[SweepProbe],
+                 until: int, dt: float, sample_every: int, chunk_steps: int = 1000):
+        super().__init__(name=f'nengo_3d sweep {connection.addr}', daemon=True)
+        self.connection = connection
+        self.request_id = request_id
+        self.probes = probes
+        self.until = until
+        self.dt = dt
+        self.sample_every = sample_every
+        self.chunk_steps = chunk_steps
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        server = self.connection.server
+        parameters: Sequence[Any] = server.sweep
+        with multiprocessing.Manager() as manager:
+            results = manager.Queue()
+            stop = manager.Event()
+            with ProcessPoolExecutor(max_workers=server.sweep_workers) as pool:
+                futures: dict[Future, int] = {}
+                for run, parameter in enumerate(parameters):
+                    self.send_run(run, 'queued')
+                    futures[pool.submit(simulate_run, server.model_factory, parameter, run, self.probes, self.until,
+                                        self.dt, self.sample_every, self.chunk_steps, server.decoder_cache_dir,
+                                        self.connection.simulator_options, results, stop)] = run
+                while futures or not results.empty():
+                    if self._stop_event.is_set() and not stop.is_set():
+                        stop.set()
+                        for future in futures:
+                            future.cancel()
+                    try:
+                        self.handle_result(results.get(timeout=0.1))
+                    except queue.Empty:
+                        pass
+                    for future in [f for f in futures if f.done()]:
+                        self.finish_run(futures.pop(future), future)
+        logger.info(f'Sweep of {len(parameters)} runs finished')
+
+    def handle_result(self, result: tuple) -> None:
+        if result[0] == 'started':
+            self.send_run(result[1], 'running')
+            return
+        _, run, start, arrays = result
+        blocks = []
+        for probe, array in zip(self.probes, arrays):
+            data, precision_meta = nengo_3d_frames.quantize(array, probe.precision)
+            blocks.append(({'node_name': probe.source, 'access_path': probe.access_path, 'start': start,
+                            'stride': self.sample_every, 'run': run, **precision_meta}, data))
+        parts = nengo_3d_frames.encode_arrays(schema=schemas.SimulationSteps.__name__,
+                                              data={'request_id': None, 'complete': True}, arrays=blocks)
+        connection = self.connection
+        size = sum(memoryview(part).nbytes for part in parts)
+        while not self._stop_event.is_set():
+            # credit is shared with simulation worker and granted by message handler, both hold sim_lock. It is
+            # reserved under the lock and the frame is sent without it, so slow client does not stall simulation
+            with connection.sim_lock:
+                if connection.has_credit():
+                    connection.credit_frames -= 1
+                    connection.credit_bytes -= size
+                    break
+            self._stop_event.wait(0.05)
+        else:
+            return
+        connection.send_binary(parts)
+
+    def finish_run(self, run: int, future: Future) -> None:
+        try:
+            steps = future.result()
+        except CancelledError:
+            self.send_run(run, 'cancelled')
+        except Exception as e:
+            logger.exception(f'Run {run} failed', exc_info=e)
+            self.send_run(run, 'failed', error=str(e))
+        else:
+            self.send_run(run, 'finished' if steps >= self.until else 'cancelled', step=steps)
+
+    def send_run(self, run: int, state: str, step: int = 0, error: Optional[str] = None) -> None:
+        answer = message.dumps({'schema': schemas.SweepRun.__name__,
+                                'request_id': self.request_id,
+                                'data': schemas.SweepRun().dump({'run': run,
+                                                                 'parameter': repr(self.connection.server.sweep[run]),
+                                                                 'state': state, 'step': step, 'error': error})})
+        self.connection.sendall(answer.encode('utf-8'))